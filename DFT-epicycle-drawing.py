@@ -1,8 +1,13 @@
 '''A program that animates a user drawing using epicycles'''
 from matplotlib.animation import FuncAnimation
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
-import tkinter as tk
+import xml.etree.ElementTree as ET
+import argparse
+import hashlib
+import os
+import re
 import numpy as np
 
 
@@ -10,61 +15,220 @@ class Fourier(object):
 
     @staticmethod
     def DFT(x_data, y_data):
-        F, f, A, phi = [],[],[],[]
+        # F_i = 1/N * sum_j (x_j + i*y_j) * exp(-2*pi*i*i*j/N), computed with an FFT
         N = len(y_data)
+        F = np.fft.fft(np.asarray(x_data) + 1j*np.asarray(y_data)) / N
+        f = np.arange(N)
+        A = np.abs(F)
+        phi = np.angle(F)
 
-        for i in range(N):
-            F_i = 0 + 0j
-            for j in range(N):
-                F_i += complex(x_data[j], y_data[j]) * np.exp(-1j*2*np.pi*i*j / N)
-           
-            F_i /= N
-            F.append(F_i)
-            f.append(i)
-            A.append(abs(F_i))
-            phi.append(np.arctan2(F_i.imag, F_i.real))
+        return F, f, A, phi
+
+    @staticmethod
+    def cached_DFT(x_data, y_data, cache=None):
+        # DFT memoized on disk under a hash of the points, so rendering the same drawing again skips the transform
+        if cache is None:
+            return Fourier.DFT(x_data, y_data)
 
+        points = np.ascontiguousarray([x_data, y_data], dtype=float)
+        path = os.path.join(cache, f"dft-{hashlib.sha1(points.tobytes()).hexdigest()}.npy")
+        if os.path.exists(path):
+            F = np.load(path)
+            return F, np.arange(len(F)), np.abs(F), np.angle(F)
+
+        F, f, A, phi = Fourier.DFT(x_data, y_data)
+        os.makedirs(cache, exist_ok=True)
+        np.save(path, F)
         return F, f, A, phi
+
+    @staticmethod
+    def resample(x_data, y_data, N=None, path_starts=()):
+        # Mouse events arrive unevenly spaced, so respace the drawing uniformly by arc length to N points
+        # (by default the next power of two) and find where each path start lands in the new drawing.
+        # Every path is respaced on its own with a share of N by length, so no points fall on the pen-up gaps
+        x_data, y_data = np.asarray(x_data, float), np.asarray(y_data, float)
+        if N is None:
+            N = 1 << max(len(x_data)-1, 1).bit_length()
+
+        bounds = np.clip(np.r_[path_starts if len(path_starts) else [0], len(x_data)], 0, len(x_data)).astype(int)
+        paths = [(x_data[i:j], y_data[i:j]) for i, j in zip(bounds[:-1], bounds[1:])]
+        s = [np.concatenate([[0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))]) for x, y in paths]
+
+        # Split N between the paths by length, or by point count when nothing has any length
+        sizes = np.array([len(x) for x, y in paths])
+        weights = np.array([s_i[-1] for s_i in s])
+        if weights.sum() == 0:
+            weights = sizes.astype(float)
+        counts = np.floor(N * weights / weights.sum()).astype(int)
+        counts[sizes > 0] = np.maximum(counts[sizes > 0], 1)
+        counts[np.argmax(weights)] += N - counts.sum()
+
+        # A single path wraps around to its own start, separate paths end where the pen is lifted
+        x_new, y_new = [], []
+        for (x, y), s_i, count in zip(paths, s, counts):
+            s_new = np.linspace(0, s_i[-1] if len(x) else 0, count, endpoint=len(paths) > 1)
+            x_new.append(np.interp(s_new, s_i, x) if s_i[-1] else np.full(count, x[0] if len(x) else 0.0))
+            y_new.append(np.interp(s_new, s_i, y) if s_i[-1] else np.full(count, y[0] if len(y) else 0.0))
+
+        new_starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).tolist() if len(path_starts) else []
+        return np.concatenate(x_new), np.concatenate(y_new), new_starts
    
+    # Unit circle shared by every epicycle, scaled by A and offset to each center per frame
+    UNIT_CIRCLE = np.exp(1j*np.linspace(0, 2*np.pi, 100))
+
+    @staticmethod
+    def epicycle_tips(F, f, frames, N=None):
+        # Position after each epicycle for every frame in frames, shape (len(frames), len(F)+1).
+        # Column 0 is the origin and column k the tip of the k-th circle, one complex cumsum over
+        # the outer product of times and frequencies since A*exp(i*(f*t + phi)) = F*exp(i*f*t)
+        N = len(F) if N is None else N
+        time_steps = np.asarray(frames)*(2*np.pi / N)
+        tips = np.zeros((len(time_steps), len(F)+1), dtype=complex)
+        np.cumsum(F * np.exp(1j*np.outer(time_steps, f)), axis=1, out=tips[:, 1:])
+        return tips
+
     @staticmethod
-    def calculate_circles(F, f, A, phi):
-        circle_x_data = [[] for _ in range(len(F))]
-        circle_y_data = [[] for _ in range(len(F))]
-        connector_x_data = [[] for _ in range(len(F))]
-        connector_y_data = [[] for _ in range(len(F))]
-        drawing_path_x_data = []
-        drawing_path_y_data = []
-
-        for frame in range(len(F)):
-            time_step = frame*(2*np.pi / len(F))
-            x, y = 0, 0
-            for i in range(len(F)):
-                temp_x = x
-                temp_y = y
-                x += A[i] * np.cos(f[i]*time_step + phi[i])
-                y += A[i] * np.sin(f[i]*time_step + phi[i])
-
-                circle_x_data[i].append(temp_x + A[i]*np.cos(np.linspace(0, 2*np.pi, 100)))
-                circle_y_data[i].append(temp_y + A[i]*np.sin(np.linspace(0, 2*np.pi, 100)))
-                connector_x_data[i].append([temp_x, x])
-                connector_y_data[i].append([temp_y, y])
-                       
-            drawing_path_x_data.append(x)
-            drawing_path_y_data.append(y)
+    def drawing_path(F, f, N=None, chunk=256):
+        # Final tip for every frame, generated chunk frames at a time so only chunk*len(F) values are live
+        N = len(F) if N is None else N
+        path = np.empty(N, dtype=complex)
+        for start in range(0, N, chunk):
+            frames = np.arange(start, min(start+chunk, N))
+            path[frames] = Fourier.epicycle_tips(F, f, frames, N)[:, -1]
+        return path.real, path.imag
 
+    @staticmethod
+    def calculate_circles(F, f, A, phi, frame, N=None):
+        # Circle and connector geometry for a single frame
+        tips = Fourier.epicycle_tips(F, f, [frame], N)[0]
+        circles = tips[:-1, np.newaxis] + np.asarray(A)[:, np.newaxis]*Fourier.UNIT_CIRCLE
         return [
-            circle_x_data,
-            circle_y_data,
-            connector_x_data,
-            connector_y_data,
-            drawing_path_x_data,
-            drawing_path_y_data,
+            circles.real,
+            circles.imag,
+            tips.real,
+            tips.imag,
         ]
-       
+
+    @staticmethod
+    def truncate(F, f, A, phi, energy=None, K=None):
+        # Keep the largest coefficients only, either a fixed K of them or the fewest whose share of
+        # the spectral energy sum(A**2) reaches energy. Expects F, f, A, phi sorted by descending A
+        if energy is not None:
+            cumulative = np.cumsum(np.square(A))
+            K = int(np.searchsorted(cumulative, energy*cumulative[-1])) + 1
+        K = len(F) if K is None else max(1, min(K, len(F)))
+        return F[:K], f[:K], A[:K], phi[:K]
+
+
+class DrawingFile(object):
+
+    @staticmethod
+    def load(path, samples=16):
+        # Points of a drawing as x_data, y_data and the index where each path starts, scaled to fit the canvas.
+        # .npy holds an (n, 2) array and .csv rows of x, y, with a row of NaN between paths. For .svg every
+        # subpath of every <path> element is a path, with curves sampled at samples points per segment
+        if path.endswith(".svg"):
+            paths = DrawingFile.svg_paths(path, samples)
+        else:
+            points = np.load(path) if path.endswith(".npy") else np.loadtxt(path, delimiter=",", ndmin=2)
+            paths = [p[~np.isnan(p).any(axis=1)] for p in np.split(points, np.flatnonzero(np.isnan(points).any(axis=1)))]
+            paths = [p for p in paths if len(p)]
+        if not paths:
+            raise ValueError(f"{path} holds no points.")
+
+        path_starts = np.cumsum([0] + [len(p) for p in paths[:-1]]).tolist()
+        x_data, y_data = np.concatenate(paths).T
+        center = (np.array([x_data.max(), y_data.max()]) + [x_data.min(), y_data.min()]) / 2
+        scale = max(x_data.max()-x_data.min(), y_data.max()-y_data.min()) / 1.8 or 1
+        return (x_data-center[0]) / scale, (y_data-center[1]) / scale, path_starts
+
+    @staticmethod
+    def svg_paths(path, samples=16):
+        # Polylines of the subpaths in the d attributes of an SVG file, with y flipped to point up.
+        # Supports M, L, H, V, C, S, Q, T and Z in absolute and relative form, arcs become straight lines
+        t = np.linspace(0, 1, samples+1)[1:, np.newaxis]
+        paths = []
+        for element in ET.parse(path).iter():
+            if not element.tag.endswith("path") or "d" not in element.attrib:
+                continue
+
+            tokens = re.findall(r"[A-Za-z]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?", element.attrib["d"])
+            current, start, control, command, i = np.zeros(2), np.zeros(2), None, None, 0
+            points = []
+            while i < len(tokens):
+                if tokens[i].isalpha():
+                    command = tokens[i]
+                    i += 1
+                relative = command.islower()
+                op = command.upper()
+                if op == "Z":
+                    points.append(start.copy())
+                    current, control = start.copy(), None
+                    if len(points) > 1:
+                        paths.append(np.array(points))
+                    points = []
+                    continue
+
+                arity = {"M": 2, "L": 2, "T": 2, "H": 1, "V": 1, "S": 4, "Q": 4, "C": 6, "A": 7}[op]
+                values = np.array(tokens[i:i+arity], dtype=float)
+                i += arity
+                if op == "H":
+                    values = np.array([values[0] + current[0]*relative, current[1]])
+                elif op == "V":
+                    values = np.array([current[0], values[0] + current[1]*relative])
+                elif op == "A":
+                    values = values[5:] + current*relative
+                elif relative:
+                    values = values + np.tile(current, arity // 2)
+                nodes = values.reshape(-1, 2)
+
+                if op == "M":
+                    if len(points) > 1:
+                        paths.append(np.array(points))
+                    points, start = [nodes[0]], nodes[0]
+                    command = "l" if relative else "L"
+                elif op in ("L", "H", "V", "A"):
+                    points.append(nodes[0])
+                else:
+                    if op in ("S", "T"):
+                        reflected = current if control is None else 2*current - control
+                        nodes = np.vstack([reflected, nodes])
+                    p = np.vstack([current, nodes])
+                    if len(p) == 3:
+                        curve = (1-t)**2*p[0] + 2*(1-t)*t*p[1] + t**2*p[2]
+                    else:
+                        curve = (1-t)**3*p[0] + 3*(1-t)**2*t*p[1] + 3*(1-t)*t**2*p[2] + t**3*p[3]
+                    points.extend(curve)
+                control = nodes[-2] if op in ("C", "S", "Q", "T") else None
+                current = nodes[-1]
+            if len(points) > 1:
+                paths.append(np.array(points))
+
+        return [p * [1, -1] for p in paths]
+
 
 class FourierDrawingCanvas(object):    
 
-    def __init__(self) -> None:
+    def __init__(self, resample=False, energy=None, K=None, progressive=False, preview=False, min_distance=0.01,
+                 cache=None) -> None:
+        self.resample = resample
+
+        # Directory the coefficients of finished drawings are cached in, by a hash of their points
+        self.cache = cache
+
+        # Mouse samples closer than min_distance to the last kept sample of the stroke are dropped
+        self.min_distance = min_distance
+        self.background = None
+
+        # Optionally draw the curve of the truncated epicycles live while drawing
+        self.preview = preview
+        self.preview_object = None
+
+        # Epicycle truncation, keep a fraction of the spectral energy or a fixed number K of terms.
+        # A progressive animation redraws the curve with 1, 2, 4, ... terms up to that limit
+        self.energy = energy
+        self.K = K
+        self.progressive = progressive
         self.mouse_x_data = []
         self.mouse_y_data = []
         self.num_drawing_paths = 0  
@@ -73,6 +237,9 @@ class FourierDrawingCanvas(object):
         self.user_drawing_object_list = []
 
     def create_drawing_canvas(self):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        import tkinter as tk
+
         root = tk.Tk()
         root.wm_title("The World is Your Canvas!")
         self.fig = Figure(figsize=(8,8))
@@ -87,23 +254,53 @@ class FourierDrawingCanvas(object):
         tk.mainloop()
 
     def _on_mouse_hold(self, event):
-        if event.inaxes and event.button and self.button.cget("text") == "Finished!":
+        if event.inaxes and event.button and self.button.cget("text") == "Finished!" and self.num_drawing_paths:
+            if len(self.mouse_x_data) > self.drawn_pixel_memory and np.hypot(event.xdata - self.mouse_x_data[-1],
+                                                                             event.ydata - self.mouse_y_data[-1]) < self.min_distance:
+                return
+
             self.mouse_x_data.append(event.xdata)
             self.mouse_y_data.append(event.ydata)
-            self.user_drawing_object_list[self.num_drawing_paths-1] = self.ax.plot(self.mouse_x_data[self.drawn_pixel_memory:],
-                                                                                   self.mouse_y_data[self.drawn_pixel_memory:],
-                                                                                   color="purple")
-            self.ax.figure.canvas.draw()
+            self.user_drawing_object_list[-1].set_data(self.mouse_x_data[self.drawn_pixel_memory:],
+                                                       self.mouse_y_data[self.drawn_pixel_memory:])
+
+            # Only the current stroke and the preview are animated, everything else is in the saved background
+            canvas = self.ax.figure.canvas
+            canvas.restore_region(self.background)
+            self.ax.draw_artist(self.user_drawing_object_list[-1])
+            if self.preview:
+                self._preview_drawing()
+                self.ax.draw_artist(self.preview_object)
+            canvas.blit(self.ax.bbox)
+
+    def _preview_drawing(self):
+        # Curve the finished epicycles would trace over one period, from an FFT of the samples so far
+        # and an inverse FFT of the truncated spectrum
+        F, f, A, phi, N, num_frames, path_starts = self._epicycles(cached=False)
+        spectrum = np.zeros(N, dtype=complex)
+        spectrum[f] = F
+        preview = np.fft.ifft(spectrum) * N
+        if self.preview_object is None:
+            self.preview_object = self.ax.plot([],[], color="white", linewidth=0.5, animated=True)[0]
+        self.preview_object.set_data(preview.real, preview.imag)
    
     def _on_mouse_press(self, event):
         if self.button.cget("text") == "Finished!":
             self.num_drawing_paths += 1
-            self.user_drawing_object_list.append(None)
+            for user_drawing_object in self.user_drawing_object_list:
+                user_drawing_object.set_animated(False)
+            self.user_drawing_object_list.append(self.ax.plot([],[], color="purple", animated=True)[0])
+
+            # Finished strokes become part of the background that each motion event is blitted onto
+            canvas = self.ax.figure.canvas
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.ax.bbox)
             self.drawn_pixel_memory = len(self.mouse_x_data)
             self.drawn_pixel_memory_list.append(len(self.mouse_x_data))
 
     def _on_button_press(self):
         self.ax.clear()
+        self.preview_object = None
         self.ax.set_xlim(-1,1)
         self.ax.set_ylim(-1,1)
         self.ax.figure.canvas.draw()
@@ -121,19 +318,74 @@ class FourierDrawingCanvas(object):
             self.drawn_pixel_memory = 0
             self.drawn_pixel_memory_list.clear()
 
+    def _epicycles(self, cached=True):
+        # Coefficients sorted by amplitude and truncated, the number N of time steps in one period,
+        # and the number of frames and path starts of the drawing within that period. With cached=False
+        # the DFT skips self.cache, as the live preview does for drawings that are still changing
+        x_data, y_data, path_starts = self.mouse_x_data, self.mouse_y_data, self.drawn_pixel_memory_list
+        if self.resample:
+            x_data, y_data, path_starts = Fourier.resample(x_data, y_data, path_starts=path_starts)
+        F, f, A, phi = Fourier.cached_DFT(x_data, y_data, self.cache if cached else None)
+
+        order = np.argsort(A, kind="stable")[::-1]
+        A, F, f, phi = A[order], F[order], f[order], phi[order]
+        N = len(F)
+        F, f, A, phi = Fourier.truncate(F, f, A, phi, self.energy, self.K)
+        return F, f, A, phi, N, len(x_data), path_starts
+
+    def load_drawing(self, path, samples=16):
+        # Use the points of a drawing file instead of a mouse drawing, see DrawingFile.load
+        x_data, y_data, path_starts = DrawingFile.load(path, samples)
+        self.mouse_x_data, self.mouse_y_data = x_data.tolist(), y_data.tolist()
+        self.drawn_pixel_memory_list = path_starts
+        self.num_drawing_paths = len(path_starts)
+
+    def render(self, out, fps=30, dpi=100):
+        # Draw the animation with Agg, to a video for out like epicycles.mp4 or .gif, or to one image
+        # per frame for a printf style pattern like frames/%05d.png
+        self.fig = Figure(figsize=(8,8))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_axes((0,0,1,1),xlim=[-1,1],ylim=[-1,1],fc="black")
+        _animation_func, num_frames = self._epicycle_animation()
+
+        if "%" in out:
+            os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+            for frame in range(num_frames):
+                _animation_func(frame)
+                self.fig.savefig(out % frame, dpi=dpi)
+        else:
+            FuncAnimation(self.fig, _animation_func, num_frames, cache_frame_data=False).save(out, fps=fps, dpi=dpi)
+
     def _animate_user_drawing(self):
-        F, f, A, phi = Fourier.DFT(self.mouse_x_data, self.mouse_y_data)
-        A, F, f, phi = (list(i) for i in zip(*sorted(zip(A, F, f, phi), reverse=True)))
-        circle_x_data, circle_y_data, connector_x_data, connector_y_data, drawing_path_x_data, drawing_path_y_data = Fourier.calculate_circles(F, f, A, phi)
+        _animation_func, num_frames = self._epicycle_animation()
+        ANIMATION = FuncAnimation(self.fig, _animation_func, num_frames, interval=1, blit=True)
+
+    def _epicycle_animation(self):
+        # Frame function drawing the epicycles onto self.ax and its number of frames
+        F, f, A, phi, N, num_frames, path_starts = self._epicycles()
 
-        circle_object_list = [self.ax.plot([],[], color="darkgrey", linewidth=0.1)[0] for _ in range(len(F))]
-        connector_object_list = [self.ax.plot([],[], color="white", linewidth=0.75)[0] for _ in range(len(F))]
+        # Number of terms drawn in each pass over the frames of the curve
+        stages = [len(F)]
+        if self.progressive:
+            stages = [min(1 << i, len(F)) for i in range((len(F)-1).bit_length()+1)]
+        drawing_paths = {}
+
+        # All circles are one collection and all connectors one polyline through the tips, so each
+        # frame blits three kinds of artist however many coefficients there are
+        circle_collection = LineCollection([], colors="darkgrey", linewidths=0.1)
+        self.ax.add_collection(circle_collection, autolim=False)
+        connector_object = self.ax.plot([],[], color="white", linewidth=0.75)[0]
         drawing_path_object_list = [self.ax.plot([],[], color="purple")[0] for _ in range(self.num_drawing_paths)]
         self.drawing_path_object_index = 0
 
         def _animation_func(frame):
+            k = stages[frame // num_frames]
+            frame %= num_frames
+            if k not in drawing_paths:
+                drawing_paths[k] = Fourier.drawing_path(F[:k], f[:k], N)
+            drawing_path_x_data, drawing_path_y_data = drawing_paths[k]
            
-            if frame in self.drawn_pixel_memory_list and frame != 0:
+            if frame in path_starts and frame != 0:
                 self.drawing_path_object_index += 1
            
             if frame == 0:
@@ -141,17 +393,37 @@ class FourierDrawingCanvas(object):
                 for drawing_path_object in drawing_path_object_list:
                     drawing_path_object.set_data([],[])
            
-            drawing_path_object_list[self.drawing_path_object_index].set_data(drawing_path_x_data[self.drawn_pixel_memory_list[self.drawing_path_object_index]:frame],
-                                                                        drawing_path_y_data[self.drawn_pixel_memory_list[self.drawing_path_object_index]:frame])
-            for i in range(len(F)):
-                circle_object_list[i].set_data(circle_x_data[i][frame], circle_y_data[i][frame])
-                connector_object_list[i].set_data(connector_x_data[i][frame], connector_y_data[i][frame])
-           
-            self.ax.figure.canvas.draw()
-            return circle_object_list + connector_object_list + drawing_path_object_list
-       
-        ANIMATION = FuncAnimation(self.fig, _animation_func, len(F), interval=1, blit=True)
+            drawing_path_object_list[self.drawing_path_object_index].set_data(drawing_path_x_data[path_starts[self.drawing_path_object_index]:frame],
+                                                                        drawing_path_y_data[path_starts[self.drawing_path_object_index]:frame])
+            circle_x_data, circle_y_data, connector_x_data, connector_y_data = Fourier.calculate_circles(F[:k], f[:k], A[:k], phi[:k], frame, N)
+            circle_collection.set_segments(np.stack([circle_x_data, circle_y_data], axis=-1))
+            connector_object.set_data(connector_x_data, connector_y_data)
+            return [circle_collection, connector_object] + drawing_path_object_list
+
+        return _animation_func, num_frames*len(stages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("drawing", nargs="?", help=".npy, .csv or .svg file to render headless instead of drawing by hand")
+    parser.add_argument("--out", default="epicycles.mp4", help="video file, or a pattern like frames/%%05d.png for images")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--samples", type=int, default=16, help="points per SVG curve segment")
+    parser.add_argument("--cache", default=".epicycle_cache", help="coefficient cache directory")
+    parser.add_argument("--resample", action="store_true", help="respace the points uniformly by arc length")
+    parser.add_argument("--energy", type=float, help="fraction of the spectral energy the kept epicycles hold")
+    parser.add_argument("-K", type=int, help="number of epicycles kept")
+    parser.add_argument("--progressive", action="store_true", help="redraw with 1, 2, 4, ... epicycles")
+    args = parser.parse_args()
 
+    fdc = FourierDrawingCanvas(resample=args.resample, energy=args.energy, K=args.K, progressive=args.progressive,
+                               cache=args.cache)
+    if args.drawing is None:
+        fdc.create_drawing_canvas()
+    else:
+        fdc.load_drawing(args.drawing, args.samples)
+        fdc.render(args.out, args.fps, args.dpi)
 
-fdc = FourierDrawingCanvas()
-fdc.create_drawing_canvas()
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,25 @@ from numpy import *
 from matplotlib import pyplot as plt
 import cmath
 import math
+import sys
+import wave
 from matplotlib.animation import FuncAnimation
 from matplotlib.patches import ConnectionPatch
 
 # Line density for Fourier Transform
 DENSITY = 6
 
+# Number of animation frames, frame i winds the signal at frequency 0.01*i
+FRAMES = 510
+
+# Recording to visualize instead of f(t), a .wav or .npy file given on the command line
+SIGNAL = sys.argv[1] if len(sys.argv) > 1 else None
+
+# Short-time Fourier Transform window length and hop in samples, and the sample rate assumed for .npy signals
+WINDOW = 2048
+HOP = 512
+RATE = 44100
+
 
 # Function
 def f(t):
@@ -21,10 +34,66 @@ def g(t,omega):
     return f(t)*exp(-2*pi*omega*1j*t)
 
 
+# Recording input, read chunk samples at a time as mono floats in [-1, 1]
+def open_signal(path, chunk=HOP):
+    if path.endswith(".npy"):
+        data = load(path, mmap_mode="r")
+        # Integers are scaled like WAV samples, unsigned ones centered like 8 bit WAV
+        scale = 2**(8*data.dtype.itemsize-1) if issubdtype(data.dtype, integer) else 1
+        offset = scale if issubdtype(data.dtype, unsignedinteger) else 0
+        def chunks():
+            for start in range(0, len(data), chunk):
+                samples = (asarray(data[start:start+chunk], dtype=float) - offset) / scale
+                yield samples.reshape(len(samples), -1).mean(axis=1)
+        return RATE, chunks()
+
+    wav = wave.open(path, "rb")
+    width, channels = wav.getsampwidth(), wav.getnchannels()
+    def chunks():
+        with wav:
+            while frames := wav.readframes(chunk):
+                if width == 3:
+                    b = frombuffer(frames, dtype=uint8).reshape(-1, 3).astype(int32)
+                    samples = ((b[:,0] | b[:,1] << 8 | b[:,2] << 16) << 8 >> 8) / 2**23
+                elif width == 1:
+                    samples = (frombuffer(frames, dtype=uint8).astype(int16) - 128) / 128
+                else:
+                    samples = frombuffer(frames, dtype={2: int16, 4: int32}[width]) / 2**(8*width-1)
+                yield samples.reshape(-1, channels).mean(axis=1)
+    return wav.getframerate(), chunks()
+
+
+# Overlapping windows of the recording, one every hop samples, as (index of the last sample, window).
+# Samples left over at the end go into one last window padded with zeros
+def windows(chunks, size=WINDOW, hop=HOP):
+    window = zeros(size)
+    pending = zeros(0)
+    end = 0
+    for samples in chunks:
+        pending = concatenate([pending, samples])
+        while len(pending) >= hop:
+            window = concatenate([window[hop:], pending[:hop]])
+            pending = pending[hop:]
+            end += hop
+            yield end, window
+    if len(pending):
+        window = concatenate([window[hop:], pending, zeros(hop - len(pending))])
+        yield end + len(pending), window
+
+
 ##############################
 ##############################
 
 
+# Every frame's winding, its center of mass and the traced signal computed in one pass, shape (FRAMES, 1000)
+freqs = 0.01*arange(FRAMES)
+delta_t = linspace(0.0001,DENSITY,1000)
+winding = g(delta_t, freqs[:,newaxis])
+center = winding.mean(axis=1)
+signal = f(freqs)
+traced = g(freqs,freqs).real
+
+
 fig,(ax1,ax2,ax3) = plt.subplots(
     ncols=3,
     sharey=True,
@@ -57,14 +126,6 @@ wrapline, = ax2.plot([],[],color="orange",alpha=1)
 point, = ax2.plot([],[],"o")
 pointline, = ax3.plot([],[])
 
-xdata, ydata = [[],[],[]],[[],[],[]]
-
-point_x = 0
-point_y = 0
-
-point_xdata = []
-point_ydata = []
-
 # Connection
 con = ConnectionPatch(
     (1, 0),
@@ -91,46 +152,61 @@ def init():
 
 
 
-def anim(frame):
-   
-    t = 0.01*frame
-    freq = t
+def anim_window(frame):
+    end, samples = frame
+    t = (end - WINDOW + arange(WINDOW)) / rate
 
-    delta_t = linspace(0.0001,DENSITY,1000)
-    x = g(delta_t,freq).real
-    y = g(delta_t,freq).imag
-    wrapline.set_data(y,x)
+    # Graph 1, the current window of the recording
+    line1.set_data(t, samples)
+    ax1.set_xlim(t[0], t[-1])
 
-    # Graph 1
-    xdata[0].append(t)
-    xdata[1].append(t)
-    ydata[0].append(f(t))
-    ydata[1].append(g(t,freq))
+    # Graph 3, the center of mass of the tapered window wound at every frequency, one FFT
+    spectrum = fft.rfft(taper*samples) / WINDOW
+    pointline.set_data(stft_freqs, abs(spectrum))
 
+    # Graph 2, the winding at the strongest frequency, whose center of mass is that FFT bin
+    k = argmax(abs(spectrum[1:])) + 1
+    winding = taper*samples*exp(-2*pi*1j*k*arange(WINDOW)/WINDOW)
+    wrapline.set_data(winding.imag, winding.real)
+    point.set_data([spectrum[k].imag], [spectrum[k].real])
 
-    # Graph 2
-    xdata[2].append(g(t,freq).real)
-    ydata[2].append(g(t,freq).imag)
+    con.xy1 = spectrum[k].imag, spectrum[k].real
+    con.xy2 = stft_freqs[k], abs(spectrum[k])
 
-    point_x = average(x)
-    point_y = average(y)
+    return line1,line2,wrapline,point,pointline,
 
 
-    # Graph 3
-    point_xdata.append(t)
-    point_ydata.append(point_x)
+def anim(frame):
+    # Graph 1, the signal up to the current time
+    line1.set_data(freqs[:frame+1], signal[:frame+1])
+    line2.set_data(freqs[:frame+1], traced[:frame+1])
 
+    # Graph 2, the winding and its center of mass
+    wrapline.set_data(winding[frame].imag, winding[frame].real)
+    point.set_data([center[frame].imag], [center[frame].real])
 
-    line1.set_data(xdata[0], ydata[0])
-    line2.set_data(xdata[1], ydata[1])
-    point.set_data(point_y, point_x)
-    pointline.set_data(point_xdata, point_ydata)
+    # Graph 3, the real part of the center of mass over frequency
+    pointline.set_data(freqs[:frame+1], center.real[:frame+1])
     
-    con.xy1 = point_y, point_x
-    con.xy2 = t, point_x
+    con.xy1 = center[frame].imag, center[frame].real
+    con.xy2 = freqs[frame], center[frame].real
 
     return line1,line2,wrapline,point,pointline,
 
 
-an = FuncAnimation(fig, anim, init_func = init, frames = 510, interval = 1, blit = True, repeat = False)
+if SIGNAL is None:
+    an = FuncAnimation(fig, anim, init_func = init, frames = FRAMES, interval = 1, blit = True, repeat = False)
+else:
+    # The axes limits follow the stream, so every frame is redrawn in full
+    rate, chunks = open_signal(SIGNAL)
+    taper = hanning(WINDOW)
+    stft_freqs = fft.rfftfreq(WINDOW, 1/rate)
+
+    ax1.set_ylim(-1.1,1.1)
+    ax2.set_xlim(-1.1,1.1)
+    ax3.set_xlim(0,rate/2)
+    ax1.set_title("Signal window")
+    ax3.set_title("Window Spectrum |f(v)|")
+    an = FuncAnimation(fig, anim_window, init_func = init, frames = windows(chunks), interval = 1, blit = False,
+                       repeat = False, cache_frame_data = False)
 plt.show()
@@ -1,5 +1,11 @@
 '''Lorenz Attractor'''
 
+import hashlib
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from scipy import integrate
 import matplotlib.pyplot as plt
@@ -8,26 +14,346 @@ from matplotlib.animation import FuncAnimation
 def ode(r, t, rho, sigma, beta):
     return [sigma*(r[1]-r[0]), r[0]*(rho-r[2])-r[1], r[0]*r[1]-beta*r[2]]
 
-dt = 0.05
-deltat = np.arange(0, 60, dt)
-solv = integrate.odeint(ode, [0,0.1,0], deltat, args=(28, 10, 8/3))
+def ode_batch(R, rho, sigma, beta):
+    '''Lorenz RHS for an (N,3) array of states in one vectorized call.'''
+    x, y, z = R[:, 0], R[:, 1], R[:, 2]
+    dR = np.empty_like(R)
+    dR[:, 0] = sigma*(y-x)
+    dR[:, 1] = x*(rho-z)-y
+    dR[:, 2] = x*y-beta*z
+    return dR
 
-x_solv = [item[0] for item in solv]
-y_solv = [item[1] for item in solv]
-z_solv = [item[2] for item in solv]
+def jacobian(r, t, rho, sigma, beta):
+    '''Analytic Jacobian of the Lorenz RHS at r.'''
+    return np.array([[-sigma, sigma, 0],
+                     [rho-r[2], -1, -r[0]],
+                     [r[1], r[0], -beta]])
 
-fig = plt.figure()
-ax = plt.subplot(projection="3d",
-                 xlim=[-25,25], ylim=[-25,25], zlim=[-5,45],
-                 xlabel="x(t)", ylabel="y(t)", zlabel="z(t)")
+def variational(r, Q, args):
+    '''Lorenz RHS together with the tangent dynamics dQ/dt = J(r) Q.'''
+    return np.array(ode(r, 0, *args)), jacobian(r, 0, *args) @ Q
 
-line, = ax.plot3D([],[],[], color="steelblue")
-point, = ax.plot3D([],[],[],"o", color="steelblue")
+# Dormand-Prince 5(4) tableau
+DP_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+]
+DP_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+DP_E = DP_B - np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
 
-def anim(frame):
-    ax.set_title(f"t={frame*dt:.2f}")
-    line.set_data_3d(x_solv[:frame], y_solv[:frame], z_solv[:frame])
-    point.set_data_3d(x_solv[frame:frame+1], y_solv[frame:frame+1], z_solv[frame:frame+1])
+def rk4_step(R, h, args):
+    k1 = ode_batch(R, *args)
+    k2 = ode_batch(R + h/2*k1, *args)
+    k3 = ode_batch(R + h/2*k2, *args)
+    k4 = ode_batch(R + h*k3, *args)
+    return R + h/6*(k1 + 2*k2 + 2*k3 + k4)
 
-an = FuncAnimation(fig, anim, frames=len(solv), interval=1)
-plt.show()
+def dopri5(R, t0, t1, h, args, rtol, atol):
+    '''
+    Advance the whole batch R from t0 to t1 with adaptive Dormand-Prince 5(4) steps.\n
+    Every state shares one step size, controlled by the worst scaled error in the batch.
+    Returns the new states and the last accepted step size.
+    '''
+    t = t0
+    k = [None]*7
+    k[0] = ode_batch(R, *args)
+    while t < t1:
+        h = min(h, t1-t)
+        for i in range(1, 7):
+            k[i] = ode_batch(R + h*sum(a*k[j] for j, a in enumerate(DP_A[i]) if a), *args)
+        R_new = R + h*sum(b*k[i] for i, b in enumerate(DP_B) if b)
+        err = h*sum(e*k[i] for i, e in enumerate(DP_E))
+        scale = atol + rtol*np.maximum(np.abs(R), np.abs(R_new))
+        err_norm = np.sqrt(np.mean((err/scale)**2, axis=1)).max()
+
+        if err_norm <= 1:
+            t += h
+            R = R_new
+            k[0] = k[6]
+        h *= min(5, max(0.2, 0.9*err_norm**-0.2)) if err_norm > 0 else 5
+    return R, h
+
+def integrate_batch(R0, deltat, args=(28, 10, 8/3), method="rk4", every=1, rtol=1e-6, atol=1e-9):
+    '''
+    Integrate an (N,3) cloud of initial conditions over the time grid deltat.\n
+    method="rk4": Fixed step RK4 with the spacing of deltat\n
+    method="dopri5": Adaptive Dormand-Prince 5(4) with one step size for the whole batch\n
+    Only every k-th frame is kept, so memory is len(deltat)/every * N * 3 floats.
+    Returns the kept times and an array of shape (frames, N, 3).
+    '''
+    R = np.array(R0, dtype=float)
+    t_out = deltat[::every]
+    frames = np.empty((len(t_out), len(R), 3))
+    frames[0] = R
+
+    if method == "rk4":
+        h = deltat[1]-deltat[0]
+        for i in range(1, len(deltat)):
+            R = rk4_step(R, h, args)
+            if i % every == 0:
+                frames[i//every] = R
+
+    elif method == "dopri5":
+        h = (deltat[1]-deltat[0])*every
+        for i in range(1, len(t_out)):
+            R, h = dopri5(R, t_out[i-1], t_out[i], h, args, rtol, atol)
+            frames[i] = R
+
+    else:
+        raise NameError(f"{method} is not an option.")
+
+    return t_out, frames
+
+def lyapunov_spectrum(r0=(0, 0.1, 0), args=(28, 10, 8/3), dt=0.01, qr_every=10, transient=10):
+    '''
+    Yield running estimates (t, [l1, l2, l3]) of the Lyapunov spectrum, one per re-orthonormalization.\n
+    The state and an orthonormal tangent frame Q are stepped together with RK4, and every qr_every steps
+    Q is re-orthonormalized by QR. The logs of |diag(R)| accumulate into the exponents, so nothing but
+    the current state is ever stored. The first transient time units only settle onto the attractor.
+    The generator never ends, stop iterating once the estimates have converged.
+    '''
+    r = np.array(r0, dtype=float)
+    Q = np.eye(3)
+    log_sum = np.zeros(3)
+    t = 0.0
+    steps = 0
+
+    while True:
+        k1 = variational(r, Q, args)
+        k2 = variational(r + dt/2*k1[0], Q + dt/2*k1[1], args)
+        k3 = variational(r + dt/2*k2[0], Q + dt/2*k2[1], args)
+        k4 = variational(r + dt*k3[0], Q + dt*k3[1], args)
+        r = r + dt/6*(k1[0] + 2*k2[0] + 2*k3[0] + k4[0])
+        Q = Q + dt/6*(k1[1] + 2*k2[1] + 2*k3[1] + k4[1])
+        steps += 1
+
+        if steps % qr_every == 0:
+            Q, R = np.linalg.qr(Q)
+
+            # Keep Q a proper rotation of the previous frame by making diag(R) positive
+            Q *= np.sign(np.diag(R))
+            if steps*dt > transient:
+                t += qr_every*dt
+                log_sum += np.log(np.abs(np.diag(R)))
+                yield t, log_sum/t
+
+def z_maxima(rhos, sigma=10, beta=8/3, r0=(0, 0.1, 0), dt=0.01, t_end=200, transient=100):
+    '''
+    Return the local maxima of z(t) after the transient for every rho in rhos.\n
+    All rho values are stepped together as one batch with RK4 and peaks are picked out as the
+    states stream past, refined by a parabola through the three samples around each one.
+    '''
+    rhos = np.asarray(rhos, dtype=float)
+    R = np.tile(np.array(r0, dtype=float), (len(rhos), 1))
+    args = (rhos, sigma, beta)
+    peaks = [[] for _ in rhos]
+
+    z2 = z1 = None
+    for i in range(1, int(round(t_end/dt))+1):
+        R = rk4_step(R, dt, args)
+        z0 = R[:, 2].copy()
+        if z2 is not None and i*dt > transient:
+            for j in np.flatnonzero((z1 > z2) & (z1 >= z0)):
+                curvature = z0[j] - 2*z1[j] + z2[j]
+                peaks[j].append(z1[j] - (z0[j]-z2[j])**2 / (8*curvature) if curvature else z1[j])
+        z2, z1 = z1, z0
+
+    return [np.array(p) for p in peaks]
+
+def bifurcation(rhos, sigma=10, beta=8/3, r0=(0, 0.1, 0), dt=0.01, t_end=200, transient=100,
+                cache=".lorenz_cache", max_workers=None, chunk=64):
+    '''
+    Return the z maxima for every rho in rhos, see z_maxima.\n
+    The grid is split into chunks of rho values that run across a process pool. Results are
+    memoized in cache, one file per set of integration settings, so re-plotting or extending
+    the rho range only computes the points that are new.
+    '''
+    settings = {"sigma": sigma, "beta": beta, "r0": list(map(float, r0)), "dt": dt, "t_end": t_end, "transient": transient}
+    key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    path = None if cache is None else os.path.join(cache, f"bifurcation-{key}.npz")
+
+    # Cached peaks are stored flattened, with offsets marking where each rho starts
+    known = {}
+    if path is not None and os.path.exists(path):
+        with np.load(path) as data:
+            for rho, peaks in zip(data["rhos"], np.split(data["peaks"], data["offsets"][1:-1])):
+                known[float(rho)] = peaks
+
+    missing = sorted({float(rho) for rho in rhos} - known.keys())
+    if missing:
+        chunks = [missing[i:i+chunk] for i in range(0, len(missing), chunk)]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(z_maxima, c, sigma, beta, r0, dt, t_end, transient) for c in chunks]
+            for c, future in zip(chunks, futures):
+                known.update(zip(c, future.result()))
+
+        if path is not None:
+            os.makedirs(cache, exist_ok=True)
+            all_rhos = sorted(known)
+            offsets = np.cumsum([0] + [len(known[rho]) for rho in all_rhos])
+            np.savez(path, rhos=all_rhos, offsets=offsets, peaks=np.concatenate([known[rho] for rho in all_rhos]))
+
+    return [known[float(rho)] for rho in rhos]
+
+def jac_kwargs(method, args):
+    '''solve_ivp keyword arguments passing the analytic Jacobian to the solvers that use one.'''
+    if method in ("RK23", "RK45", "DOP853"):
+        return {}
+    return {"jac": lambda t, r: jacobian(r, t, *args)}
+
+def solve(r0, deltat, args=(28, 10, 8/3), method="odeint", rtol=1e-6, atol=1e-9):
+    '''
+    Integrate one initial condition over the time grid deltat and return a (len(deltat), 3) array.\n
+    method="odeint": LSODA through odeint\n
+    method="RK45", "DOP853", "Radau", "BDF", "LSODA": scipy.integrate.solve_ivp\n
+    Every solver that uses a Jacobian gets the analytic one instead of finite differences.
+    '''
+    if method == "odeint":
+        return integrate.odeint(ode, r0, deltat, args=args, Dfun=jacobian, rtol=rtol, atol=atol)
+
+    sol = integrate.solve_ivp(lambda t, r: ode(r, t, *args), (deltat[0], deltat[-1]), r0, method=method,
+                              t_eval=deltat, rtol=rtol, atol=atol,
+                              **jac_kwargs(method, args))
+    if not sol.success:
+        raise RuntimeError(sol.message)
+    return sol.y.T
+
+def stream(r0, args=(28, 10, 8/3), dt=0.05, chunk=200, method="odeint", rtol=1e-6, atol=1e-9):
+    '''
+    Yield (t, states) chunks of chunk samples spaced dt apart, forever.\n
+    Each chunk is solved from the last state of the previous one, so memory stays constant
+    however long the generator is consumed.
+    '''
+    r = np.array(r0, dtype=float)
+    t0 = 0.0
+    while True:
+        deltat = t0 + dt*np.arange(chunk+1)
+        states = solve(r, deltat, args, method, rtol, atol)
+        yield deltat[:-1], states[:-1]
+        r, t0 = states[-1], deltat[-1]
+
+def poincare_section(r0=(0, 0.1, 0), args=(28, 10, 8/3), t_end=1000, plane=None, direction=-1,
+                     method="DOP853", segment=1000, transient=10, rtol=1e-9, atol=1e-12):
+    '''
+    Return the times (k,) and points (k,3) where the trajectory crosses the plane z = plane.\n
+    plane defaults to z = rho-1 and direction=-1 keeps only downward crossings. Crossings are found by
+    solve_ivp event detection, which refines each root on the dense output, and apart from the end
+    of each segment no other samples are kept. The run is split into segments so even millions of time units only hold the crossings.
+    '''
+    rho = args[0]
+    plane = rho-1 if plane is None else plane
+
+    def event(t, r):
+        return r[2]-plane
+    event.direction = direction
+
+    r = np.array(r0, dtype=float)
+    times, points = [], []
+    for t0 in np.arange(0, t_end, segment):
+        t1 = min(t0+segment, t_end)
+        sol = integrate.solve_ivp(lambda t, r: ode(r, t, *args), (t0, t1), r, method=method, t_eval=[t1],
+                                  events=event, rtol=rtol, atol=atol,
+                                  **jac_kwargs(method, args))
+        if not sol.success:
+            raise RuntimeError(sol.message)
+        keep = sol.t_events[0] > transient
+        times.append(sol.t_events[0][keep])
+        points.append(sol.y_events[0][keep].reshape(-1, 3))
+        r = sol.y[:, -1]
+    return np.concatenate(times), np.concatenate(points)
+
+def main(method="odeint", dt=0.05, trail=1200):
+    '''Animate a single trajectory indefinitely, keeping only the last trail samples of its path.'''
+    chunks = stream([0,0.1,0], (28, 10, 8/3), dt, method=method)
+
+    def frames():
+        for deltat, states in chunks:
+            yield from zip(deltat, states)
+
+    x_solv = deque(maxlen=trail)
+    y_solv = deque(maxlen=trail)
+    z_solv = deque(maxlen=trail)
+
+    fig = plt.figure()
+    ax = plt.subplot(projection="3d",
+                     xlim=[-25,25], ylim=[-25,25], zlim=[-5,45],
+                     xlabel="x(t)", ylabel="y(t)", zlabel="z(t)")
+
+    line, = ax.plot3D([],[],[], color="steelblue")
+    point, = ax.plot3D([],[],[],"o", color="steelblue")
+
+    def anim(frame):
+        t, r = frame
+        x_solv.append(r[0])
+        y_solv.append(r[1])
+        z_solv.append(r[2])
+        ax.set_title(f"t={t:.2f}")
+        line.set_data_3d(x_solv, y_solv, z_solv)
+        point.set_data_3d(r[0:1], r[1:2], r[2:3])
+
+    an = FuncAnimation(fig, anim, frames=frames, interval=1, cache_frame_data=False)
+    plt.show()
+
+def main_batch(N=100000, spread=1e-3, every=25):
+    '''Animate a cloud of N initial conditions around [0,0.1,0] spreading over the attractor.'''
+    dt = 0.01
+    deltat = np.arange(0, 30, dt)
+    R0 = np.array([0, 0.1, 0]) + spread*np.random.default_rng(0).standard_normal((N, 3))
+    t_out, frames = integrate_batch(R0, deltat, method="rk4", every=every)
+
+    fig = plt.figure()
+    ax = plt.subplot(projection="3d",
+                     xlim=[-25,25], ylim=[-25,25], zlim=[-5,45],
+                     xlabel="x(t)", ylabel="y(t)", zlabel="z(t)")
+    cloud = ax.scatter(*frames[0].T, s=0.1, color="steelblue", depthshade=False)
+
+    def anim(frame):
+        ax.set_title(f"t={t_out[frame]:.2f}, spread={frames[frame].std(axis=0).mean():.2e}")
+        cloud._offsets3d = tuple(frames[frame].T)
+
+    an = FuncAnimation(fig, anim, frames=len(t_out), interval=1)
+    plt.show()
+
+def main_lyapunov(rho=28, sigma=10, beta=8/3, t_end=1000):
+    '''Print running Lyapunov spectrum estimates for (rho, sigma, beta) every 100 time units.'''
+    report = 100
+    for t, spectrum in lyapunov_spectrum(args=(rho, sigma, beta)):
+        if t >= report - 1e-9:
+            report += 100
+            print(f"t={t:.0f}: {spectrum[0]:+.4f} {spectrum[1]:+.4f} {spectrum[2]:+.4f} (sum {spectrum.sum():+.4f})")
+        if t >= t_end:
+            return spectrum
+
+def main_bifurcation(rho_min=20, rho_max=200, points=2000):
+    '''Plot the bifurcation diagram of the z maxima over rho.'''
+    rhos = np.linspace(rho_min, rho_max, points)
+    peaks = bifurcation(rhos)
+
+    fig = plt.figure()
+    ax = plt.subplot(xlim=[rho_min, rho_max], xlabel="rho", ylabel="max z(t)")
+    ax.plot(np.repeat(rhos, [len(p) for p in peaks]), np.concatenate(peaks), ",", color="steelblue")
+    plt.show()
+
+def main_poincare(t_end=10000, return_map=True):
+    '''Plot the crossings of z = rho-1 and, optionally, the next-return map of x at the section.'''
+    times, points = poincare_section(t_end=t_end)
+    print(f"{len(times)} crossings, {points.nbytes} bytes")
+
+    fig = plt.figure(figsize=(10, 5) if return_map else None)
+    ax = plt.subplot(1, 2 if return_map else 1, 1, xlabel="x", ylabel="y", title="z = rho-1")
+    ax.plot(points[:, 0], points[:, 1], ",", color="steelblue")
+    if return_map:
+        ax = plt.subplot(1, 2, 2, xlabel="x(n)", ylabel="x(n+1)", title="Next-return map")
+        ax.plot(points[:-1, 0], points[1:, 0], ",", color="steelblue")
+    plt.show()
+
+if __name__ == "__main__":
+    # python lorenzattractor.py [animate|batch|lyapunov|bifurcation|poincare]
+    modes = {"animate": main, "batch": main_batch, "lyapunov": main_lyapunov, "bifurcation": main_bifurcation,
+             "poincare": main_poincare}
+    modes[sys.argv[1] if len(sys.argv) > 1 else "animate"]()
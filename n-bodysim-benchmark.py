@@ -0,0 +1,131 @@
+'''Work-precision benchmark for the force kernels and integrators of n-bodysim.py'''
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import tracemalloc
+from time import perf_counter
+import numpy as np
+
+# n-bodysim.py is a script with a hyphen in its name, so it has to be loaded by path
+_spec = importlib.util.spec_from_file_location("nbodysim", os.path.join(os.path.dirname(os.path.abspath(__file__)), "n-bodysim.py"))
+nbodysim = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(nbodysim)
+
+# Accuracy knob swept for each integrator: odeint rtol, fixed step dt, block timestep eta
+SWEEPS = {
+    "odeint": ("rtol", (1e-4, 1e-6, 1e-8)),
+    "leapfrog": ("dt", (0.02, 0.01, 0.005)),
+    "yoshida4": ("dt", (0.02, 0.01, 0.005)),
+    "block": ("eta", (0.02, 0.01, 0.005)),
+}
+
+
+def make_space(n, force, integrator, knob, value, t=0.2, seed=0):
+    '''Return a Space holding a cold uniform sphere of n Bodies with total mass 1 and G=1.'''
+    rng = np.random.default_rng(seed)
+    r = rng.normal(size=(n, 3))
+    r *= (rng.uniform(size=(n, 1))**(1/3) / np.linalg.norm(r, axis=1, keepdims=True))
+    v = 0.1 * rng.normal(size=(n, 3))
+
+    dt = value if knob == "dt" else 0.05
+    kwargs = {"rtol": value, "atol": value} if knob == "rtol" else {"eta": value} if knob == "eta" else {}
+    space = nbodysim.Space(t=t, dt=dt, G=1, force=force, softening=0.01, **kwargs)
+    space.addBodies(np.full(n, 1/n), r, v)
+    return space
+
+
+def estimate_memory(n, force) -> int:
+    '''Rough peak bytes of the force kernel, the direct sum holds two (n,n,3) float temporaries at once.'''
+    return 2 * 24 * n * n if force == "direct" else 0
+
+
+def measure(n, force, integrator, knob, value) -> dict:
+    '''
+    Solve one configuration twice and return its cost and accuracy.\n
+    The first run is only timed, without diagnostics. The second traces memory, which slows the
+    Python heavy Barnes-Hut walk far more than the direct sum, and samples the energy at the first
+    and last frame for the accuracy.
+    '''
+    space = make_space(n, force, integrator, knob, value)
+    start = perf_counter()
+    space._solve(integrator)
+    wall_time = perf_counter() - start
+
+    traced = make_space(n, force, integrator, knob, value)
+    traced.drift_every = max(len(traced.t) - 1, 1)
+    tracemalloc.start()
+    traced._solve(integrator)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "n": n,
+        "force": force,
+        "integrator": integrator,
+        "knob": knob,
+        "value": value,
+        "frames": len(space.t),
+        "wall_time": wall_time,
+        "rhs_calls": space.rhs_calls,
+        "rhs_evals": space.rhs_bodies / n,
+        "peak_memory": peak,
+        "energy_error": float(np.abs(traced.energy_drift).max()),
+    }
+
+
+def benchmark(sizes, forces, integrators, budget=60.0, max_memory=2**31) -> list:
+    '''
+    Sweep body count, force path, integrator and accuracy knob.\n
+    A configuration is skipped for larger n once it has taken longer than budget seconds, or
+    when its force kernel would need more than max_memory bytes.
+    '''
+    results = []
+    for force in forces:
+        for integrator in integrators:
+            knob, values = SWEEPS[integrator]
+            for value in values:
+                for n in sorted(sizes):
+                    if estimate_memory(n, force) > max_memory:
+                        print(f"{force:>10} {integrator:>8} {knob}={value:<8g} n={n:<6} skipped, needs "
+                              f"{estimate_memory(n, force)/2**30:.1f}GiB")
+                        break
+                    result = measure(n, force, integrator, knob, value)
+                    results.append(result)
+                    print(f"{force:>10} {integrator:>8} {knob}={value:<8g} n={n:<6} "
+                          f"{result['wall_time']:8.3f}s {result['rhs_evals']:8.0f} evals "
+                          f"{result['peak_memory']/2**20:9.1f}MiB dE/E={result['energy_error']:.2e}")
+                    if result["wall_time"] > budget:
+                        break
+    return results
+
+
+def save(results, path) -> None:
+    '''Write the results as .json or .csv, chosen by the file extension.'''
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(path, "w") as file:
+            json.dump(results, file, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--forces", nargs="+", default=list(nbodysim.Space.FORCES), choices=nbodysim.Space.FORCES)
+    parser.add_argument("--integrators", nargs="+", default=list(SWEEPS), choices=list(SWEEPS))
+    parser.add_argument("--budget", type=float, default=60.0, help="seconds after which larger n are skipped")
+    parser.add_argument("--max-memory", type=float, default=2.0, help="GiB above which a force kernel is not run")
+    parser.add_argument("--out", default="nbody-benchmark.json", help=".json or .csv results file")
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.forces, args.integrators, args.budget, args.max_memory * 2**30)
+    save(results, args.out)
+
+if __name__ == "__main__":
+    main()
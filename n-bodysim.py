@@ -1,228 +1,1014 @@
-'''Simulates the forces of gravity of an n body system in a vacuum'''
-
-import numpy as np
-from scipy.integrate import odeint
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from random import uniform
-
-class Body:
-
-    def __init__(self, m, x0, y0, z0, vx0=0, vy0=0, vz0=0, point_alpha=1, line_alpha=1, size=5.67) -> None:
-        self.m = m
-
-        # Construct arrays that serve as position and velocity vectors containing x, y, and z components
-        self.r = np.array([x0, y0, z0])
-        self.vr = np.array([vx0, vy0, vz0])
-        
-        self.point = None
-        self.line = None
-        self.point_alpha = point_alpha
-        self.line_alpha = line_alpha
-        self.size = size
-        
-
-class Space:
-    
-    def __init__(self, t, dt=0.05, G=6.67e-11, xlim=[-1,1], ylim=[-1,1], zlim=[-1,1]) -> None:
-
-        # Construct empty list to hold Body objects
-        self.bl = []
-        self.n = 0
-        self.tf = t
-        self.dt = dt
-        self.t = np.arange(0, t, dt)
-        self.G = G
-
-        
-    def addBody(self, body:Body) -> None:
-        '''Add a Body object to the system.'''
-        self.bl.append(body)
-        self.n += 1
-
-
-    def addSolarSystem(self) -> None:
-        '''Experimental. Increase xlim, ylim, zlim values.'''
-        sun = Body(m=1.989e30, size=6, x0=0, y0=0, z0=0, vx0=0, vy0=0, vz0=0)
-        earth = Body(m=5.97e24, size=1.4, x0=1.4959e11, y0=0, z0=0, vx0=0, vy0=30000, vz0=0)
-        mercury = Body(m=3.285e23, size=1.22, x0=6.7233e10, y0=0, z0=0, vx0=0, vy0=47000, vz0=0)
-        venus = Body(m=4.867e24, size=1.35, x0=1.082e11, y0=0, z0=0, vx0=0, vy0=35020, vz0=0)
-        mars = Body(m=6.41693e23, size=1.42, x0=2.3142e11, y0=0, z0=0, vx0=0, vy0=24077, vz0=0)
-        jupiter = Body(m=1.899e27, size=2, x0=7.4435e11, y0=0, z0=0, vx0=0, vy0=13070, vz0=0)
-        saturn = Body(m=5.683e26, size=1, x0=1.4e12, y0=0, z0=0, vx0=0, vy0=9680, vz0=0)
-        uranus = Body(m=8.681e25, size=1, x0=2.934e12, y0=0, z0=0, vx0=0, vy0=6810, vz0=0)
-        neptune = Body(m=1.024e26, size=1, x0=4.4726e12, y0=0, z0=0, vx0=0, vy0=5400, vz0=0)
-        self.addBody(sun)
-        self.addBody(earth)
-        self.addBody(mercury)
-        self.addBody(venus)
-        self.addBody(mars)
-        self.addBody(jupiter)
-        self.addBody(saturn)
-        self.addBody(uranus)
-        self.addBody(neptune)
-
-    @staticmethod
-    def getRandomBody() -> Body:
-        '''Return a Body object with random parameters'''
-        return Body(1, uniform(-1,1), uniform(-1,1), uniform(-1,1))
-
-    
-    def _solve(self) -> None:
-        
-        # Construct empty lists to contain lists of x, y, and z coordinates for each Body for each frame
-        self.x_state = np.empty(self.n).tolist()
-        self.y_state = np.empty(self.n).tolist()
-        self.z_state = np.empty(self.n).tolist()
-        
-        # Initial state
-        state0 = np.array([[body.r for body in self.bl], [body.vr for body in self.bl]]).flatten()
-
-        # Solve ODE system numerically over the given time interval t
-        states = odeint(func=self._ode, y0=state0, t=self.t).flatten()
-
-        # Extract x, y, and z coordinates from states array
-        for i in range(self.n):
-            self.x_state[i] = states[i*3::self.n*6]
-            self.y_state[i] = states[i*3+1::self.n*6]
-            self.z_state[i] = states[i*3+2::self.n*6]    
-            
-    # Iterates over a time interval t and returns an array S containing the current position and velocity vectors of the system.
-    def _ode(self, S, t) -> np.ndarray:
-        drdt_data = np.zeros(self.n).tolist()
-        dvdt_data = np.zeros(self.n).tolist()
-
-        # dvdt_sep_data holds each of the values for the forces between any two Bodies.
-        # There are n x n-1 relationships for any given system.
-        dvdt_sep_data = np.zeros([self.n, self.n-1]).tolist()
-
-
-        # Update each Body's position and velocity vectors to the newest state
-        for i in range(self.n):
-            self.bl[i].r = S[3*i:3*(i+1)]
-            self.bl[i].vr = S[3*(i+self.n):3*(i+self.n+1)]
-        
-        # Iterate through each Body for each Body, i and j cannot be equal.
-        for i in range(self.n):
-            for j in range(self.n-1):
-                dvdt_sep_data[i][j] = (self.G*self.bl[i-j-1].m*(self.bl[i-j-1].r - self.bl[i].r)) / (np.linalg.norm(self.bl[i].r - self.bl[i-j-1].r)**3)
-
-            # Convert to array, then sum up all the forces on each Body
-            dvdt_sep_data[i] = np.array(dvdt_sep_data[i])
-            dvdt_data[i] = dvdt_sep_data[i].sum(axis=0)
-            drdt_data[i] = self.bl[i].vr
-        
-        # Return the next state
-        return np.array([drdt_data, dvdt_data]).flatten()
-    
-    
-    def _init_anim(self, xlim, ylim, zlim) -> None:
-
-        # 3D plot
-        self.fig = plt.figure()
-        self.ax = plt.subplot(projection="3d")
-        self.ax.set_xlim(xlim)
-        self.ax.set_ylim(ylim)
-        self.ax.set_zlim(zlim)
-        self.ax.set_xlabel("x(t)")
-        self.ax.set_ylabel("y(t)")
-        self.ax.set_zlabel("z(t)")
-
-        # Construct Line3DCollection objects and initialize them to line and point attributes
-        for body in self.bl:
-            body.line, = self.ax.plot3D([],[],[], alpha=body.line_alpha)
-            body.point, = self.ax.plot3D([],[],[], "o", alpha=body.point_alpha, markersize=body.size)
-
-    
-    def _init_plot(self, xlim, ylim, zlim) -> None:
-
-        # Axes and 3D plot
-        fig = plt.figure(figsize=(12,8))
-        x_ax = plt.subplot(3,3,1)
-        y_ax = plt.subplot(3,3,2)
-        z_ax = plt.subplot(3,3,3)
-        param_ax = plt.subplot(3,3,(4,9), projection="3d")
-
-        # x(t) plot
-        x_ax.set_xlim(0, self.tf)
-        x_ax.set_ylim(xlim)
-        x_ax.grid()
-        x_ax.set_xlabel("t")
-        x_ax.set_ylabel("x(t)")
-        x_ax.set_title("x(t)")
-
-        # y(t) plot
-        y_ax.set_xlim(0, self.tf)
-        y_ax.set_ylim(ylim)
-        y_ax.grid()
-        y_ax.set_xlabel("t")
-        y_ax.set_ylabel("y(t)")
-        y_ax.set_title("y(t)")
-
-        # z(t) plot
-        z_ax.set_xlim(0, self.tf)
-        z_ax.set_ylim(zlim)
-        z_ax.grid()
-        z_ax.set_xlabel("t")
-        z_ax.set_ylabel("z(t)")
-        z_ax.set_title("z(t)")
-
-        # 3D plot
-        param_ax.set_xlim(xlim)
-        param_ax.set_ylim(ylim)
-        param_ax.set_zlim(zlim)
-        param_ax.grid()
-        param_ax.set_xlabel("x(t)")
-        param_ax.set_ylabel("y(t)")
-        param_ax.set_zlabel("z(t)")
-
-        # Plot data
-        for i in range(self.n):
-            x_ax.plot(self.t, self.x_state[i][:])
-            y_ax.plot(self.t, self.y_state[i][:])
-            z_ax.plot(self.t, self.z_state[i][:])
-            param_ax.plot3D(self.x_state[i][:], 
-                       self.y_state[i][:], 
-                       self.z_state[i][:])
-            
-
-    # Update window every frame
-    def _update(self, frame) -> None:
-        self.ax.set_title("t=%.2fs" % (frame*self.dt))
-        for i in range(self.n):
-            self.bl[i].point.set_data_3d(self.x_state[i][frame:frame+1], self.y_state[i][frame:frame+1], self.z_state[i][frame:frame+1])
-            self.bl[i].line.set_data_3d(self.x_state[i][:frame], self.y_state[i][:frame], self.z_state[i][:frame])
-    
-
-    def run(self, mode="animate", xlim=(-1,1), ylim=(-1,1), zlim=(-1,1)) -> None:
-        
-        '''
-        Run simulation based on mode selected:\n
-        mode="animate": Animates the bodies\n
-        mode="plot": Plots each of the body's coordinates over time
-        '''
-        
-        self._solve()
-        
-        if mode == "animate":
-            self._init_anim(xlim, ylim, zlim)
-            ani = FuncAnimation(self.fig, self._update, frames=int(self.tf/self.dt), interval=1)
-        
-        elif mode == "plot":
-            self._init_plot(xlim, ylim, zlim)
-        
-        else:
-            raise NameError(f"{mode} is not an option.")
-
-        plt.show()
-
-
-def main():
-    space = Space(t=20, dt=0.05, G=6.67e-11)
-    space.addBody(Body(m=5e9, x0=-0.1, y0=-0.9, z0=-0.5, vx0=0.0, vy0=0.0, vz0=0.0))
-    space.addBody(Body(m=5e9, x0=0.7, y0=0.1, z0=0.4, vx0=-0.0, vy0=0.0, vz0=0.1))
-    space.addBody(Body(m=5e9, x0=-1.2, y0=0.6, z0=0, vx0=-0.0, vy0=-0.0, vz0=-0.1))
-    space.run(mode="animate", xlim=(-1,1), ylim=(-1,1), zlim=(-1,1))
-
-if __name__ == "__main__":
-    main()
+'''Simulates the forces of gravity of an n body system in a vacuum'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from scipy.integrate import odeint
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+from matplotlib.colors import to_rgba_array
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+from random import uniform
+from time import perf_counter
+
+
+def _pairwise_accel(ri, rj, mj, G, eps2=0) -> np.ndarray:
+    '''Return the acceleration on each target at ri due to every source at rj with masses mj, softened by eps2.'''
+
+    # d[i,j] = rj_j - ri_i, the separation vector pointing from target i to source j
+    d = rj[np.newaxis, :, :] - ri[:, np.newaxis, :]
+    dist2 = np.einsum("ijk,ijk->ij", d, d)
+    dist3 = (dist2 + eps2)**1.5
+
+    # A Body exerts no force on itself (or on anything sitting exactly on top of it)
+    dist3[dist2 == 0] = np.inf
+    return G * np.einsum("ij,ijk->ik", mj / dist3, d)
+
+
+def _pairwise_accel_jerk(xi, xj, mj, G, eps2=0) -> np.ndarray:
+    '''
+    Return the acceleration and its time derivative, the jerk, on each target due to every source.\n
+    xi and xj hold positions and velocities side by side with shape (n,6), as does the result.
+    '''
+    d = xj[np.newaxis, :, :3] - xi[:, np.newaxis, :3]
+    dv = xj[np.newaxis, :, 3:] - xi[:, np.newaxis, 3:]
+    dist2 = np.einsum("ijk,ijk->ij", d, d)
+
+    # A Body exerts nothing on itself, masked before dividing so an unsoftened self pair never makes 0/0
+    with np.errstate(divide="ignore"):
+        inv2 = 1 / (dist2 + eps2)
+    inv2[dist2 == 0] = 0
+
+    # j = G*sum m*(dv/s**3 - 3*(d.dv)*d/s**5) with s**2 = dist2 + eps2
+    w = mj * inv2**1.5
+    rv = 3 * np.einsum("ijk,ijk->ij", d, dv) * inv2
+    return G * np.concatenate([np.einsum("ij,ijk->ik", w, d), np.einsum("ij,ijk->ik", w, dv - rv[:, :, np.newaxis] * d)], axis=1)
+
+
+def _pairwise_potential(ri, rj, mj, G, eps2=0) -> np.ndarray:
+    '''Return the gravitational potential at each target at ri due to every source at rj with masses mj.'''
+    d = rj[np.newaxis, :, :] - ri[:, np.newaxis, :]
+    dist2 = np.einsum("ijk,ijk->ij", d, d)
+    dist = np.sqrt(dist2 + eps2)
+    dist[dist2 == 0] = np.inf
+    return -G * (1 / dist) @ mj
+
+
+# Shared thread pool for the tiled kernels, NumPy releases the GIL inside its array loops
+_thread_pool = None
+
+
+def _tiled(kernel, ri, rj, mj, G, eps2=0, tile=256) -> np.ndarray:
+    '''
+    Evaluate a pairwise kernel over tile x tile blocks of targets and sources.\n
+    Blocks of target rows run in parallel on a thread pool and each one walks the sources a tile at
+    a time, so temporaries stay at (tile, tile, 3) per thread instead of (n, n, 3).
+    '''
+    global _thread_pool
+
+    def rows(i0):
+        return sum(kernel(ri[i0:i0+tile], rj[j0:j0+tile], mj[j0:j0+tile], G, eps2) for j0 in range(0, len(rj), tile))
+
+    if len(ri) <= tile:
+        return rows(0) if len(rj) else kernel(ri, rj, mj, G, eps2)
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return np.concatenate(list(_thread_pool.map(rows, range(0, len(ri), tile))))
+
+
+def _scatter_add(acc, idx, vals) -> None:
+    '''acc[idx] += vals for repeated indices, one bincount per component.'''
+    for k in range(3):
+        acc[:, k] += np.bincount(idx, weights=vals[:, k], minlength=len(acc))
+
+
+class Octree:
+    '''
+    Barnes-Hut octree over a set of point masses.\n
+    Every node stores its total mass, center of mass and side length. Leaves hold up to
+    leaf_size bodies as a contiguous slice of self.order.
+    '''
+
+    def __init__(self, r, m, leaf_size=8, max_depth=32) -> None:
+        self.r = r
+        self.m = m
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+
+        self.order = []
+        self.mass = []
+        self.com = []
+        self.side = []
+        self.children = []
+        self.leaf_start = []
+        self.leaf_count = []
+
+        # Root cube encloses every body
+        lo, hi = r.min(axis=0), r.max(axis=0)
+        half = max((hi - lo).max() / 2, 1e-12) * (1 + 1e-9)
+        self._build(np.arange(len(r)), (lo + hi) / 2, half, 0)
+
+        self.order = np.array(self.order, dtype=int)
+        self.mass = np.array(self.mass)
+        self.com = np.array(self.com)
+        self.side = np.array(self.side)
+        self.children = np.array(self.children, dtype=int)
+        self.leaf_start = np.array(self.leaf_start, dtype=int)
+        self.leaf_count = np.array(self.leaf_count, dtype=int)
+
+    def _build(self, idx, center, half, depth) -> int:
+        node = len(self.mass)
+        m = self.m[idx]
+        self.mass.append(m.sum())
+        self.com.append(m @ self.r[idx] / m.sum() if m.sum() else self.r[idx].mean(axis=0))
+        self.side.append(2*half)
+        self.children.append([-1]*8)
+        self.leaf_start.append(len(self.order))
+        self.leaf_count.append(0)
+
+        if len(idx) <= self.leaf_size or depth == self.max_depth:
+            self.order.extend(idx)
+            self.leaf_count[node] = len(idx)
+            return node
+
+        # Split the bodies into the 8 octants around the center of this cube
+        octant = (self.r[idx] >= center) @ np.array([1, 2, 4])
+        for o in range(8):
+            sub = idx[octant == o]
+            if len(sub):
+                sign = np.array([o & 1, (o >> 1) & 1, (o >> 2) & 1]) * 2 - 1
+                self.children[node][o] = self._build(sub, center + sign*half/2, half/2, depth + 1)
+        return node
+
+    def accel(self, G, theta=0.5, targets=None, eps2=0) -> np.ndarray:
+        '''
+        Return the acceleration on every body, or only on the bodies indexed by targets.\n
+        A node is accepted as a single point mass when side/distance < theta, otherwise it is opened.
+        All bodies walk the tree together as a frontier of (body, node) pairs.
+        '''
+        pos = self.r if targets is None else self.r[targets]
+        acc = np.zeros((len(pos), 3))
+        for bi, d, mass in self._walk(pos, theta):
+            dist2 = np.einsum("ij,ij->i", d, d)
+            dist3 = (dist2 + eps2)**1.5
+            dist3[dist2 == 0] = np.inf
+            _scatter_add(acc, bi, d * (G * mass / dist3)[:, np.newaxis])
+        return acc
+
+    def potential(self, G, theta=0.5, targets=None, eps2=0) -> np.ndarray:
+        '''Return the gravitational potential at every body, or only at the bodies indexed by targets, see accel.'''
+        pos = self.r if targets is None else self.r[targets]
+        phi = np.zeros(len(pos))
+        for bi, d, mass in self._walk(pos, theta):
+            dist2 = np.einsum("ij,ij->i", d, d)
+            dist = np.sqrt(dist2 + eps2)
+            dist[dist2 == 0] = np.inf
+            phi -= np.bincount(bi, weights=G * mass / dist, minlength=len(pos))
+        return phi
+
+    def _walk(self, pos, theta):
+        '''Yield batches (target index, separation, source mass) of every interaction the tree walk accepts.'''
+        n = len(pos)
+        bodies = np.arange(n)
+        nodes = np.zeros(n, dtype=int)
+        is_leaf = (self.children < 0).all(axis=1)
+
+        while len(bodies):
+            d = self.com[nodes] - pos[bodies]
+            dist2 = np.einsum("ij,ij->i", d, d)
+            far = self.side[nodes]**2 < theta**2 * dist2
+
+            # Far away nodes act as a single point mass at their center of mass
+            if far.any():
+                yield bodies[far], d[far], self.mass[nodes[far]]
+
+            # Nearby leaves are summed body by body
+            near_leaf = ~far & is_leaf[nodes]
+            if near_leaf.any():
+                counts = self.leaf_count[nodes[near_leaf]]
+                bi = np.repeat(bodies[near_leaf], counts)
+                offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                bj = self.order[np.repeat(self.leaf_start[nodes[near_leaf]], counts) + offset]
+                yield bi, self.r[bj] - pos[bi], self.m[bj]
+
+            # Nearby internal nodes are opened and their children join the frontier
+            opened = ~far & ~is_leaf[nodes]
+            ch = self.children[nodes[opened]]
+            valid = ch >= 0
+            bodies = np.repeat(bodies[opened], valid.sum(axis=1))
+            nodes = ch[valid]
+
+
+class _BodyField:
+    '''Body attribute that lives in one of the Space arrays once the Body has been added to a Space.'''
+
+    def __init__(self, array) -> None:
+        self.array = array
+
+    def __set_name__(self, owner, name) -> None:
+        self.slot = "_" + name
+
+    def __get__(self, body, owner=None):
+        if body is None:
+            return self
+        if body._space is None:
+            return getattr(body, self.slot)
+        return getattr(body._space, self.array)[body._i]
+
+    def __set__(self, body, value) -> None:
+        if body._space is None:
+            setattr(body, self.slot, value)
+        else:
+            getattr(body._space, self.array)[body._i] = value
+
+
+class Body:
+    '''
+    A single point mass.\n
+    A standalone Body only keeps its initial conditions as plain numbers. Once it is added to a
+    Space it becomes a view onto row i of the Space arrays, so reading or setting body.r changes
+    the Space itself.
+    '''
+
+    __slots__ = ("_space", "_i", "_m", "_r", "_vr", "_radius", "_point_alpha", "_line_alpha", "_size")
+
+    m = _BodyField("m")
+    r = _BodyField("r")
+    vr = _BodyField("v")
+    radius = _BodyField("radius")
+    point_alpha = _BodyField("point_alpha")
+    line_alpha = _BodyField("line_alpha")
+    size = _BodyField("size")
+
+    def __init__(self, m, x0, y0, z0, vx0=0, vy0=0, vz0=0, point_alpha=1, line_alpha=1, size=5.67, radius=0) -> None:
+        self._space = None
+        self._i = None
+        self.m = m
+
+        # Physical radius, used only when the Space checks for collisions
+        self.radius = radius
+
+        # Position and velocity vectors containing x, y, and z components
+        self.r = (x0, y0, z0)
+        self.vr = (vx0, vy0, vz0)
+
+        self.point_alpha = point_alpha
+        self.line_alpha = line_alpha
+        self.size = size
+
+    @classmethod
+    def _view(cls, space, i):
+        body = cls.__new__(cls)
+        body._space = space
+        body._i = i
+        return body
+
+
+class Space:
+    
+    FORCES = ("direct", "barnes-hut", "tiled")
+    INTEGRATORS = ("leapfrog", "yoshida4", "block")
+
+    # Frames per odeint call and per checkpoint when streaming to disk
+    CHUNK = 1000
+
+    # Yoshida 4th order drift (C) and kick (D) coefficients
+    _W1 = 1 / (2 - 2**(1/3))
+    _W0 = -2**(1/3) * _W1
+    YOSHIDA_C = (_W1/2, (_W0 + _W1)/2, (_W0 + _W1)/2, _W1/2)
+    YOSHIDA_D = (_W1, _W0, _W1, 0)
+
+    def __init__(self, t, dt=0.05, G=6.67e-11, xlim=[-1,1], ylim=[-1,1], zlim=[-1,1], force="direct", theta=0.5,
+                 eta=0.01, max_level=12, softening=0.0, collisions=False, rtol=None, atol=None, tile=256,
+                 drift_every=None) -> None:
+
+        self.n = 0
+
+        # Struct-of-arrays body store: masses (n,), positions (n,3) and velocities (n,3),
+        # plus the collision radius and drawing style of every Body
+        self.m = np.empty(0)
+        self.r = np.empty((0, 3))
+        self.v = np.empty((0, 3))
+        self.radius = np.empty(0)
+        self.point_alpha = np.empty(0)
+        self.line_alpha = np.empty(0)
+        self.size = np.empty(0)
+
+        # Backing storage with spare capacity, the arrays above are views of their first n rows
+        self._buffers = {}
+        self.tf = t
+        self.dt = dt
+        self.t = np.arange(0, t, dt)
+        self.G = G
+
+        # Force backend used by the RHS, theta is the Barnes-Hut opening angle and tile
+        # the block size of the tiled direct sum
+        if force not in self.FORCES:
+            raise NameError(f"{force} is not an option.")
+        self.force = force
+        self.theta = theta
+        self.tile = tile
+
+        # Block timesteps: accuracy parameter and deepest power-of-two subdivision of dt
+        self.eta = eta
+        self.max_level = max_level
+
+        # Plummer softening length, and whether touching Bodies merge. odeint checks for contacts on
+        # substeps short enough that no pair can pass through each other, the other integrators only
+        # once per frame, so with those a dt much longer than radius/|v| needs softening
+        self.softening = softening
+        self.collisions = collisions
+
+        # odeint tolerances, None keeps the scipy defaults
+        self.rtol = rtol
+        self.atol = atol
+
+        # Energy and momentum are sampled every drift_every frames to measure drift, None turns it off.
+        # The energy is a full potential sum, as expensive as a force evaluation with the same backend
+        self.drift_every = drift_every
+
+        # Number of force kernel calls, and of Bodies they were evaluated for, in the last run
+        self.rhs_calls = 0
+        self.rhs_bodies = 0
+
+        
+    def addBody(self, body:Body) -> None:
+        '''Add a Body object to the system, the Body then becomes a view onto the system.'''
+        i = self.n
+        self._reserve(i + 1)
+        self.m[i], self.r[i], self.v[i], self.radius[i] = body.m, body.r, body.vr, body.radius
+        self.point_alpha[i], self.line_alpha[i], self.size[i] = body.point_alpha, body.line_alpha, body.size
+        self.n = i + 1
+        body._space = self
+        body._i = i
+
+    def addBodies(self, masses, positions, velocities=None, radius=0, point_alpha=1, line_alpha=1, size=5.67) -> None:
+        '''
+        Add many Bodies at once from arrays.\n
+        masses has shape (k,), positions and velocities (k,3). velocities defaults to rest and
+        radius, point_alpha, line_alpha and size may be scalars or (k,) arrays.
+        '''
+        masses = np.asarray(masses, dtype=float).reshape(-1)
+        k = len(masses)
+        positions = np.asarray(positions, dtype=float).reshape(k, 3)
+        velocities = 0 if velocities is None else np.asarray(velocities, dtype=float).reshape(k, 3)
+
+        new = slice(self.n, self.n + k)
+        self._reserve(self.n + k)
+        self.m[new], self.r[new], self.v[new], self.radius[new] = masses, positions, velocities, radius
+        self.point_alpha[new], self.line_alpha[new], self.size[new] = point_alpha, line_alpha, size
+        self.n += k
+
+    def _reserve(self, n) -> None:
+        '''
+        Resize the Body arrays to n rows, the rows past self.n are left for the caller to fill.\n
+        Every array is a view of a larger buffer that doubles when it runs out, so adding Bodies one at
+        a time costs amortized O(1) each instead of copying every array on every add.
+        '''
+        for name in ("m", "r", "v", "radius", "point_alpha", "line_alpha", "size"):
+            current = getattr(self, name)
+            buffer = self._buffers.get(name)
+
+            # Allocate a new buffer when full, or when the array was replaced and no longer views the buffer
+            if buffer is None or current.base is not buffer or len(buffer) < n:
+                buffer = np.empty((max(n, 2 * len(current), 16),) + current.shape[1:])
+                buffer[:self.n] = current[:self.n]
+                self._buffers[name] = buffer
+            setattr(self, name, buffer[:n])
+
+    def loadBodies(self, path, **kwargs) -> None:
+        '''
+        Add the Bodies stored in a .npy or .csv initial condition file.\n
+        Each row holds m, x, y, z, vx, vy, vz and optionally a collision radius. Lines of a .csv
+        starting with # are skipped. Extra keyword arguments are passed on to addBodies.
+        '''
+        if path.endswith(".npy"):
+            data = np.load(path)
+        elif path.endswith(".csv"):
+            data = np.loadtxt(path, delimiter=",", ndmin=2)
+        else:
+            raise NameError(f"{os.path.splitext(path)[1]} is not an option.")
+
+        if data.ndim != 2 or data.shape[1] not in (7, 8):
+            raise ValueError(f"{path} must hold rows of m, x, y, z, vx, vy, vz[, radius], got shape {data.shape}.")
+        if data.shape[1] == 8:
+            kwargs.setdefault("radius", data[:, 7])
+        self.addBodies(data[:, 0], data[:, 1:4], data[:, 4:7], **kwargs)
+
+    def getBody(self, i) -> Body:
+        '''Return a Body view onto the i-th Body of the system.'''
+        return Body._view(self, range(self.n)[i])
+
+
+    def addSolarSystem(self) -> None:
+        '''Experimental. Increase xlim, ylim, zlim values.'''
+        sun = Body(m=1.989e30, size=6, x0=0, y0=0, z0=0, vx0=0, vy0=0, vz0=0)
+        earth = Body(m=5.97e24, size=1.4, x0=1.4959e11, y0=0, z0=0, vx0=0, vy0=30000, vz0=0)
+        mercury = Body(m=3.285e23, size=1.22, x0=6.7233e10, y0=0, z0=0, vx0=0, vy0=47000, vz0=0)
+        venus = Body(m=4.867e24, size=1.35, x0=1.082e11, y0=0, z0=0, vx0=0, vy0=35020, vz0=0)
+        mars = Body(m=6.41693e23, size=1.42, x0=2.3142e11, y0=0, z0=0, vx0=0, vy0=24077, vz0=0)
+        jupiter = Body(m=1.899e27, size=2, x0=7.4435e11, y0=0, z0=0, vx0=0, vy0=13070, vz0=0)
+        saturn = Body(m=5.683e26, size=1, x0=1.4e12, y0=0, z0=0, vx0=0, vy0=9680, vz0=0)
+        uranus = Body(m=8.681e25, size=1, x0=2.934e12, y0=0, z0=0, vx0=0, vy0=6810, vz0=0)
+        neptune = Body(m=1.024e26, size=1, x0=4.4726e12, y0=0, z0=0, vx0=0, vy0=5400, vz0=0)
+        self.addBody(sun)
+        self.addBody(earth)
+        self.addBody(mercury)
+        self.addBody(venus)
+        self.addBody(mars)
+        self.addBody(jupiter)
+        self.addBody(saturn)
+        self.addBody(uranus)
+        self.addBody(neptune)
+
+    @staticmethod
+    def getRandomBody() -> Body:
+        '''Return a Body object with random parameters'''
+        return Body(1, uniform(-1,1), uniform(-1,1), uniform(-1,1))
+
+    
+    def _solve(self, integrator="odeint", output=None, chunk=None, resume=False, out=None) -> None:
+        '''
+        Integrate the system over t.\n
+        With output=None the trajectory is kept in memory, written straight into the (frames, n, 3)
+        array out when one is given. Otherwise positions are streamed into a
+        disk-backed .npy file, the sampled energy and momentum into output.drift.npy, and a checkpoint
+        of the current state is written next to them every chunk frames, so a killed run can pick up
+        where it left off with resume=True.
+        '''
+        if integrator != "odeint" and integrator not in self.INTEGRATORS:
+            raise NameError(f"{integrator} is not an option.")
+
+        frames = len(self.t)
+        shape = (frames, self.n, 3)
+
+        # One row of energy, momentum x, y, z and momentum scale per sampled frame
+        samples = len(range(0, frames, self.drift_every)) if self.drift_every else 0
+        drift_shape = (samples, 5)
+        checkpoint = None if output is None else output + ".ckpt.npz"
+        drift_output = None if output is None else output + ".drift.npy"
+        resuming = checkpoint is not None and resume and os.path.exists(checkpoint)
+
+        if output is None:
+            chunk = chunk or frames
+            positions = np.empty(shape) if out is None else out
+            if positions.shape != shape:
+                raise ValueError(f"out holds {positions.shape} frames, expected {shape}.")
+        elif resuming:
+            chunk = chunk or self.CHUNK
+            positions = np.lib.format.open_memmap(output, mode="r+")
+            if positions.shape != shape:
+                raise ValueError(f"{output} holds {positions.shape} frames, expected {shape}.")
+        else:
+            chunk = chunk or self.CHUNK
+            positions = np.lib.format.open_memmap(output, mode="w+", dtype=float, shape=shape)
+
+        # The drift history is streamed to its own file, so a checkpoint only holds the current state
+        if output is None or not samples:
+            drift = np.empty(drift_shape)
+        elif resuming:
+            drift = np.lib.format.open_memmap(drift_output, mode="r+")
+            if drift.shape != drift_shape:
+                raise ValueError(f"{drift_output} holds {drift.shape} samples, expected {drift_shape}.")
+        else:
+            drift = np.lib.format.open_memmap(drift_output, mode="w+", dtype=float, shape=drift_shape)
+        energy, momentum, scale = drift[:, 0], drift[:, 1:4], drift[:, 4]
+
+        if resuming:
+            with np.load(checkpoint) as ckpt:
+                start, r, v = int(ckpt["frame"]), ckpt["r"], ckpt["v"]
+                alive, m, radius = ckpt["alive"], ckpt["m"], ckpt["radius"]
+        else:
+            start, r, v = 0, self.r.copy(), self.v.copy()
+            alive, m, radius = np.arange(self.n), self.m, self.radius
+
+        # While integrating, m, radius and n describe only the Bodies that have not been merged away,
+        # and alive holds their indices among all Bodies
+        initial = self.m, self.radius, self.n
+        self.m, self.radius, self.n, self.alive = m, radius, len(m), alive
+        self.block_stats = {"force_evals": 0, "global_evals": 0, "saved": 0.0}
+        self.rhs_calls = 0
+        self.rhs_bodies = 0
+        try:
+            states = self._frames(integrator, r, v, start, chunk)
+            for frame in range(start, frames):
+                r, v = next(states)
+
+                # Merge touching Bodies and restart the integrator from the reduced state
+                if self.collisions:
+                    merged = self._merge(r, v)
+                    if merged is not None:
+                        r, v = merged
+                        states = self._frames(integrator, r, v, frame, chunk)
+                        r, v = next(states)
+
+                # Bodies that were merged away are left as NaN, which matplotlib does not draw
+                if len(self.alive) == len(positions[frame]):
+                    positions[frame] = r
+                else:
+                    positions[frame] = np.nan
+                    positions[frame, self.alive] = r
+                if self.drift_every and frame % self.drift_every == 0:
+                    sample = frame // self.drift_every
+                    energy[sample] = self._energy(r, v)
+                    momentum[sample] = self.m @ v
+                    scale[sample] = self.m @ np.abs(v).sum(axis=1)
+
+                # Flush finished frames to disk and record the state needed to continue from this frame
+                if checkpoint is not None and (frame % chunk == 0 or frame == frames - 1):
+                    positions.flush()
+                    if isinstance(drift, np.memmap):
+                        drift.flush()
+                    self._checkpoint(checkpoint, frame, r, v, self.alive, self.m, self.radius)
+        finally:
+            self.m, self.radius, self.n = initial
+
+        # Extract x, y, and z coordinates, each row of x_state holds one Body over time.
+        # For a file backed run these are views of the memmap, so frames are only read when drawn.
+        self.positions = positions
+        self.x_state = positions[:, :, 0].T
+        self.y_state = positions[:, :, 1].T
+        self.z_state = positions[:, :, 2].T
+
+        # Relative drift of the conserved quantities at every sampled frame, empty when drift_every is None
+        self.drift_frames = np.arange(0, frames, self.drift_every) if self.drift_every else np.empty(0, dtype=int)
+        self.energy_drift = (energy - energy[:1]) / abs(energy[:1])
+        self.momentum_drift = np.linalg.norm(momentum - momentum[:1], axis=1) / max(scale.max(initial=0), np.finfo(float).tiny)
+
+    def _merge(self, r, v):
+        '''
+        Merge every group of touching Bodies into one, conserving mass and momentum.\n
+        Returns the reduced (r, v) and shrinks self.m, self.radius, self.n and self.alive,
+        or None when nothing touches.
+        '''
+        i, j = self._contacts(r)
+        if not len(i):
+            return None
+
+        # Label every Body with the lowest index of the group it is merged into
+        label = np.arange(self.n)
+        for a, b in zip(i, j):
+            while label[a] != a:
+                a = label[a]
+            while label[b] != b:
+                b = label[b]
+            label[max(a, b)] = min(a, b)
+        while (label[label] != label).any():
+            label = label[label]
+
+        survivors = np.unique(label)
+        m = np.bincount(label, self.m)[survivors]
+        p = np.stack([np.bincount(label, self.m * v[:, k]) for k in range(3)], axis=1)[survivors]
+        com = np.stack([np.bincount(label, self.m * r[:, k]) for k in range(3)], axis=1)[survivors]
+
+        # Inelastic merge: the product sits at the center of mass and keeps the total volume
+        self.radius = np.cbrt(np.bincount(label, self.radius**3)[survivors])
+        self.m = m
+        self.n = len(m)
+        self.alive = self.alive[survivors]
+        return com / m[:, np.newaxis], p / m[:, np.newaxis]
+
+    def _contact_step(self, v) -> float:
+        '''
+        Longest time over which no two Bodies with a radius can close in by more than the smallest radius.\n
+        Their relative speed is at most twice the fastest of them, so a pair that does not touch at the
+        start of such a step cannot pass through each other, or reach the singularity, before its end.
+        '''
+        solid = self.radius > 0
+        speed = np.sqrt(np.einsum("ij,ij->i", v[solid], v[solid])).max(initial=0)
+        return self.radius[solid].min() / (2 * speed) if speed > 0 else np.inf
+
+    def _contacts(self, r) -> tuple:
+        '''
+        Return index arrays (i, j), i < j, of every pair of Bodies closer than the sum of their radii.\n
+        Bodies are hashed into a uniform grid with cells as wide as the largest diameter, so only
+        Bodies in the same or a neighboring cell are ever compared.
+        '''
+        cell = 2 * self.radius.max(initial=0)
+        if cell == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+        keys = np.floor(r / cell).astype(np.int64)
+        order = np.argsort(self._hash(keys), kind="stable")
+        sorted_hash = self._hash(keys)[order]
+
+        pairs_i, pairs_j = [], []
+        for offset in np.ndindex(3, 3, 3):
+            neighbor = self._hash(keys + np.array(offset) - 1)
+            lo = np.searchsorted(sorted_hash, neighbor, side="left")
+            hi = np.searchsorted(sorted_hash, neighbor, side="right")
+            counts = hi - lo
+            bi = np.repeat(np.arange(self.n), counts)
+            bj = order[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+            keep = bi < bj
+            pairs_i.append(bi[keep])
+            pairs_j.append(bj[keep])
+
+        # Hash collisions only add candidates, the distance test below is exact
+        i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+        d = r[i] - r[j]
+        touching = np.einsum("ij,ij->i", d, d) < (self.radius[i] + self.radius[j])**2
+        pairs = np.unique(np.stack([i[touching], j[touching]], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    @staticmethod
+    def _hash(keys) -> np.ndarray:
+        return (keys[:, 0] * 73856093) ^ (keys[:, 1] * 19349663) ^ (keys[:, 2] * 83492791)
+
+    def _frames(self, integrator, r, v, start, chunk):
+        '''Yield the (r, v) state at every frame from start onwards.'''
+        if integrator == "odeint" and self.collisions:
+            # Every frame is split into substeps, after each of which touching Bodies are merged
+            for frame in range(start, len(self.t)):
+                yield r, v
+                t, t_end = self.t[frame], self.t[frame] + self.dt
+                while t < t_end:
+                    h = min(t_end - t, self._contact_step(v))
+                    state = odeint(func=self._ode, y0=np.concatenate([r.ravel(), v.ravel()]), t=[t, t + h],
+                                   rtol=self.rtol, atol=self.atol)[-1]
+                    r, v = state[:3*self.n].reshape(self.n, 3), state[3*self.n:].reshape(self.n, 3)
+                    t = t_end if h == t_end - t else t + h
+                    merged = self._merge(r, v)
+                    if merged is not None:
+                        r, v = merged
+
+        elif integrator == "odeint":
+            # Solve ODE system numerically, chunk frames per call to bound the size of the result
+            for f0 in range(start, len(self.t), chunk):
+                t = self.t[f0:f0 + chunk + 1]
+                states = odeint(func=self._ode, y0=np.concatenate([r.ravel(), v.ravel()]), t=t, rtol=self.rtol, atol=self.atol)
+                for state in states[:chunk]:
+                    yield state[:3*self.n].reshape(self.n, 3), state[3*self.n:].reshape(self.n, 3)
+                r = states[-1, :3*self.n].reshape(self.n, 3)
+                v = states[-1, 3*self.n:].reshape(self.n, 3)
+
+        elif integrator == "block":
+            yield from self._block_frames(r, v)
+
+        else:
+            # Fixed-step integration, one step of size dt per frame
+            step = self._leapfrog if integrator == "leapfrog" else self._yoshida4
+            a = self._accel(r)
+            while True:
+                yield r, v
+                r, v, a = step(r, v, a)
+
+    def _block_frames(self, r, v):
+        '''
+        Yield the (r, v) state at every frame using hierarchical block timesteps.\n
+        Each Body steps with dt/2**level and only kicks (and needs a force evaluation) at the end
+        of its own step, every Body drifts on the finest active substep. Levels may only coarsen at
+        times aligned with the coarser step, so all Bodies are synchronized again at every frame.
+        Force evaluations are tallied in self.block_stats against a global step at the finest level.
+        '''
+        ticks = 2**self.max_level
+        h = self.dt / ticks
+
+        r, v = r.copy(), v.copy()
+        a = self._accel(r)
+        while True:
+            yield r, v
+
+            # Every Body is synchronized at a frame, open a step for all of them
+            level = self._levels(r, v, np.arange(self.n), 0)
+            finest = level.max()
+            v += a * (self.dt / 2**level)[:, np.newaxis] / 2
+            t_end = ticks >> level
+            t = 0
+            while t < ticks:
+                t_next = int(t_end.min())
+                r += v * (t_next - t) * h
+                t = t_next
+
+                # Close the step of every Body that ends now
+                active = np.flatnonzero(t_end == t)
+                a[active] = self._accel(r, active)
+                v[active] += a[active] * (self.dt / 2**level[active])[:, np.newaxis] / 2
+                self.block_stats["force_evals"] += len(active)
+
+                # Open the next step, refining freely but only coarsening where t is aligned
+                if t < ticks:
+                    level[active] = self._levels(r, v, active, t)
+                    finest = max(finest, level[active].max())
+                    v[active] += a[active] * (self.dt / 2**level[active])[:, np.newaxis] / 2
+                    t_end[active] = t + (ticks >> level[active])
+
+            # A global scheme would have put every Body on the finest step used in this frame
+            self.block_stats["global_evals"] += self.n * 2**int(finest)
+            self.block_stats["saved"] = 1 - self.block_stats["force_evals"] / self.block_stats["global_evals"]
+
+    def _levels(self, r, v, idx, t) -> np.ndarray:
+        '''
+        Return the block level of each Body in idx at tick t.\n
+        The wanted step is eta*|a|/|da/dt|, the time over which the softened acceleration of the Body
+        changes by its own size. Acceleration and jerk come from one tiled pass over all Bodies.
+        '''
+        x = np.concatenate([r, v], axis=1)
+        aj = _tiled(_pairwise_accel_jerk, x[idx], x, self.m, self.G, self.softening**2, self.tile)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dt = self.eta * np.linalg.norm(aj[:, :3], axis=1) / np.linalg.norm(aj[:, 3:], axis=1)
+            level = np.ceil(np.log2(self.dt / dt))
+        level = np.clip(np.nan_to_num(level, nan=0), 0, self.max_level).astype(int)
+
+        # Coarsen only as far as t is a multiple of the step, t % 2**(max_level - level) == 0
+        trailing_zeros = self.max_level if t == 0 else (t & -t).bit_length() - 1
+        return np.maximum(level, self.max_level - trailing_zeros)
+
+    @staticmethod
+    def _checkpoint(path, frame, r, v, alive, m, radius) -> None:
+        '''Atomically replace the checkpoint file, a crash mid-write leaves the previous one intact.'''
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, frame=frame, r=r, v=v, alive=alive, m=m, radius=radius)
+        os.replace(tmp, path)
+
+    def _leapfrog(self, r, v, a) -> tuple:
+        '''Kick-drift-kick leapfrog step, a single new force evaluation per step.'''
+        v = v + a * self.dt/2
+        r = r + v * self.dt
+        a = self._accel(r)
+        v = v + a * self.dt/2
+        return r, v, a
+
+    def _yoshida4(self, r, v, a) -> tuple:
+        '''Fourth order Yoshida step, three leapfrog drifts and kicks with weights w1, w0, w1.'''
+        for c, d in zip(self.YOSHIDA_C, self.YOSHIDA_D):
+            r = r + c * v * self.dt
+            if d:
+                a = self._accel(r)
+                v = v + d * a * self.dt
+        return r, v, a
+
+    def _energy(self, r, v) -> float:
+        '''
+        Total kinetic plus potential energy of the system.\n
+        The potential goes through the tree with the Barnes-Hut backend, otherwise through the tiled
+        direct sum, so it never needs (n,n) temporaries.
+        '''
+        if self.force == "barnes-hut":
+            phi = Octree(r, self.m).potential(self.G, self.theta, eps2=self.softening**2)
+        else:
+            phi = _tiled(_pairwise_potential, r, r, self.m, self.G, self.softening**2, self.tile)
+        return 0.5 * self.m @ np.einsum("ij,ij->i", v, v) + 0.5 * self.m @ phi
+
+    def printDrift(self) -> None:
+        '''Print the worst relative energy and momentum drift of the last run.'''
+        if not len(self.energy_drift):
+            print("drift not sampled, set drift_every to measure it")
+            return
+        print(f"max |dE/E0| = {np.abs(self.energy_drift).max():.3e}, max |dP|/sum(m|v|) = {self.momentum_drift.max():.3e}")
+
+    def _accel(self, r, idx=None) -> np.ndarray:
+        '''Return the gravitational acceleration on every Body at positions r, or only on the Bodies in idx.'''
+        self.rhs_calls += 1
+        self.rhs_bodies += self.n if idx is None else len(idx)
+        if self.force == "barnes-hut":
+            # The octree is rebuilt from scratch every time the RHS is evaluated
+            return Octree(r, self.m).accel(self.G, self.theta, idx, self.softening**2)
+        if self.force == "tiled":
+            return _tiled(_pairwise_accel, r if idx is None else r[idx], r, self.m, self.G, self.softening**2, self.tile)
+        return _pairwise_accel(r if idx is None else r[idx], r, self.m, self.G, self.softening**2)
+
+    def forceError(self, theta=None, sample=1000) -> dict:
+        '''
+        Compare the Barnes-Hut accelerations at the current positions against the direct sum.\n
+        Relative errors are measured on up to sample randomly chosen bodies, so the check
+        stays affordable for large systems. Returns error statistics and timings.
+        '''
+        theta = self.theta if theta is None else theta
+        rng = np.random.default_rng(0)
+        idx = rng.choice(self.n, size=min(sample, self.n), replace=False)
+
+        start = perf_counter()
+        tree_acc = Octree(self.r, self.m).accel(self.G, theta, eps2=self.softening**2)[idx]
+        tree_time = perf_counter() - start
+
+        start = perf_counter()
+        direct_acc = _tiled(_pairwise_accel, self.r[idx], self.r, self.m, self.G, self.softening**2, self.tile)
+        direct_time = (perf_counter() - start) * self.n / len(idx)
+
+        err = np.linalg.norm(tree_acc - direct_acc, axis=1) / np.linalg.norm(direct_acc, axis=1)
+        return {
+            "theta": theta,
+            "n": self.n,
+            "median": float(np.median(err)),
+            "p99": float(np.percentile(err, 99)),
+            "max": float(err.max()),
+            "tree_time": tree_time,
+            "direct_time": direct_time,
+        }
+
+    # Returns the time derivative of the state S = [positions, velocities] of the system.
+    def _ode(self, S, t) -> np.ndarray:
+        r = S[:3*self.n].reshape(self.n, 3)
+        return np.concatenate([S[3*self.n:], self._accel(r).ravel()])
+    
+    
+    def _init_anim(self, xlim, ylim, zlim, trail=200) -> None:
+
+        # 3D plot
+        self.fig = plt.figure()
+        self.ax = plt.subplot(projection="3d")
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        self.ax.set_zlim(zlim)
+        self.ax.set_xlabel("x(t)")
+        self.ax.set_ylabel("y(t)")
+        self.ax.set_zlabel("z(t)")
+
+        # One scatter collection holds every Body marker and one line collection every trail
+        colors = to_rgba_array([f"C{i % 10}" for i in range(self.n)])
+        point_colors, line_colors = colors.copy(), colors.copy()
+        point_colors[:, 3] = self.point_alpha
+        line_colors[:, 3] = self.line_alpha
+        self.points = self.ax.scatter(self.r[:, 0], self.r[:, 1], self.r[:, 2], s=self.size**2, c=point_colors, depthshade=False)
+        self.lines = Line3DCollection(self.r[:, np.newaxis, :], colors=line_colors)
+        self.ax.add_collection3d(self.lines)
+
+        # Ring buffer holding the last trail frames of every Body, NaN where nothing is recorded yet.
+        # trail=None keeps whole trails, which holds every frame of the trajectory in memory
+        self.trail = len(self.t) if trail is None else max(min(int(trail), len(self.t)), 1)
+        self._trail_buffer = np.full((self.trail, self.n, 3), np.nan)
+
+    
+    def _init_plot(self, xlim, ylim, zlim) -> None:
+
+        # Axes and 3D plot
+        fig = plt.figure(figsize=(12,8))
+        x_ax = plt.subplot(3,3,1)
+        y_ax = plt.subplot(3,3,2)
+        z_ax = plt.subplot(3,3,3)
+        param_ax = plt.subplot(3,3,(4,9), projection="3d")
+
+        # x(t) plot
+        x_ax.set_xlim(0, self.tf)
+        x_ax.set_ylim(xlim)
+        x_ax.grid()
+        x_ax.set_xlabel("t")
+        x_ax.set_ylabel("x(t)")
+        x_ax.set_title("x(t)")
+
+        # y(t) plot
+        y_ax.set_xlim(0, self.tf)
+        y_ax.set_ylim(ylim)
+        y_ax.grid()
+        y_ax.set_xlabel("t")
+        y_ax.set_ylabel("y(t)")
+        y_ax.set_title("y(t)")
+
+        # z(t) plot
+        z_ax.set_xlim(0, self.tf)
+        z_ax.set_ylim(zlim)
+        z_ax.grid()
+        z_ax.set_xlabel("t")
+        z_ax.set_ylabel("z(t)")
+        z_ax.set_title("z(t)")
+
+        # 3D plot
+        param_ax.set_xlim(xlim)
+        param_ax.set_ylim(ylim)
+        param_ax.set_zlim(zlim)
+        param_ax.grid()
+        param_ax.set_xlabel("x(t)")
+        param_ax.set_ylabel("y(t)")
+        param_ax.set_zlabel("z(t)")
+
+        # Plot data
+        for i in range(self.n):
+            x_ax.plot(self.t, self.x_state[i][:])
+            y_ax.plot(self.t, self.y_state[i][:])
+            z_ax.plot(self.t, self.z_state[i][:])
+            param_ax.plot3D(self.x_state[i][:], 
+                       self.y_state[i][:], 
+                       self.z_state[i][:])
+            
+
+    # Update window every frame
+    def _update(self, frame) -> None:
+        self.ax.set_title("t=%.2fs" % (frame*self.dt))
+
+        # Start over when the animation repeats, then overwrite the oldest trail frame
+        if frame == 0:
+            self._trail_buffer[:] = np.nan
+        r = self.positions[frame]
+        self._trail_buffer[frame % self.trail] = r
+
+        # Oldest to newest frame along axis 1, cost only depends on the trail length
+        order = (np.arange(1, self.trail + 1) + frame) % self.trail
+        self.points._offsets3d = (r[:, 0], r[:, 1], r[:, 2])
+        self.lines.set_segments(self._trail_buffer[order].transpose(1, 0, 2))
+    
+
+    def run(self, mode="animate", xlim=(-1,1), ylim=(-1,1), zlim=(-1,1), integrator="odeint",
+            output=None, chunk=None, resume=False, trail=200) -> None:
+        
+        '''
+        Run simulation based on mode selected:\n
+        mode="animate": Animates the bodies\n
+        mode="plot": Plots each of the body's coordinates over time\n
+        integrator="odeint": Adaptive LSODA through scipy\n
+        integrator="leapfrog": Fixed-step kick-drift-kick, one force evaluation per step\n
+        integrator="yoshida4": Fixed-step 4th order symplectic, three force evaluations per step\n
+        integrator="block": Per-body power-of-two timesteps, only Bodies that need fine steps take them\n
+        output="traj.npy": Stream positions to a .npy file, checkpointing every chunk frames\n
+        resume=True: Continue an interrupted run from the checkpoint next to output\n
+        trail=200: Only draw the last 200 frames of every trail, trail=None never cuts them
+        '''
+        
+        self._solve(integrator, output, chunk, resume)
+        if self.drift_every:
+            self.printDrift()
+        if integrator == "block":
+            print(f"block timesteps: {self.block_stats['force_evals']} force evaluations, "
+                  f"{self.block_stats['global_evals']} with a global step ({self.block_stats['saved']:.1%} saved)")
+        
+        if mode == "animate":
+            self._init_anim(xlim, ylim, zlim, trail)
+            ani = FuncAnimation(self.fig, self._update, frames=int(self.tf/self.dt), interval=1)
+        
+        elif mode == "plot":
+            self._init_plot(xlim, ylim, zlim)
+        
+        else:
+            raise NameError(f"{mode} is not an option.")
+
+        plt.show()
+
+
+def _ensemble_job(space, integrator, name) -> tuple:
+    '''Solve one Space in a worker process, writing its positions straight into the named shared memory block.'''
+    start = perf_counter()
+    shm = SharedMemory(name=name)
+    try:
+        space._solve(integrator, out=np.ndarray((len(space.t), space.n, 3), dtype=float, buffer=shm.buf))
+        # The view has to go before the block can be closed
+        space.positions = None
+    finally:
+        shm.close()
+    drift = np.abs(space.energy_drift)
+    return perf_counter() - start, float(drift.max()) if len(drift) else np.nan
+
+
+class Ensemble:
+    '''
+    Headless runner that solves many independent Space systems across a process pool.\n
+    Each job writes its (frames, n, 3) positions into its own shared memory block, so results
+    come back without pickling the arrays. Call close() (or use a with block) to release them.
+    '''
+
+    def __init__(self, spaces, integrator="leapfrog", max_workers=None) -> None:
+        self.spaces = list(spaces)
+        self.integrator = integrator
+        self.max_workers = max_workers
+        self.positions = []
+        self._shm = []
+
+    def run(self) -> dict:
+        '''Solve every Space and return per-job wall times and the overall throughput.'''
+        self.close()
+        shapes = [(len(space.t), space.n, 3) for space in self.spaces]
+        self._shm = [SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1)) for shape in shapes]
+
+        start = perf_counter()
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(_ensemble_job, space, self.integrator, shm.name)
+                       for space, shm in zip(self.spaces, self._shm)]
+            results = [future.result() for future in futures]
+        wall_time = perf_counter() - start
+
+        self.positions = [np.ndarray(shape, dtype=float, buffer=shm.buf) for shape, shm in zip(shapes, self._shm)]
+        job_times = np.array([job_time for job_time, _ in results])
+        return {
+            "jobs": len(self.spaces),
+            "wall_time": wall_time,
+            "job_times": job_times,
+            "jobs_per_second": len(self.spaces) / wall_time,
+            "frames_per_second": sum(shape[0] for shape in shapes) / wall_time,
+            "parallel_speedup": float(job_times.sum() / wall_time),
+            "energy_drift": np.array([drift for _, drift in results]),
+        }
+
+    def close(self) -> None:
+        '''Release the shared memory blocks, any arrays in self.positions become invalid.'''
+        self.positions = []
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main():
+    space = Space(t=20, dt=0.05, G=6.67e-11, drift_every=1)
+    space.addBody(Body(m=5e9, x0=-0.1, y0=-0.9, z0=-0.5, vx0=0.0, vy0=0.0, vz0=0.0))
+    space.addBody(Body(m=5e9, x0=0.7, y0=0.1, z0=0.4, vx0=-0.0, vy0=0.0, vz0=0.1))
+    space.addBody(Body(m=5e9, x0=-1.2, y0=0.6, z0=0, vx0=-0.0, vy0=-0.0, vz0=-0.1))
+    space.run(mode="animate", xlim=(-1,1), ylim=(-1,1), zlim=(-1,1))
+
+if __name__ == "__main__":
+    main()